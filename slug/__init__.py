@@ -8,7 +8,7 @@ if os.name == 'nt':  # Windows
 elif os.name == 'posix':  # Posix
     from .posix import *  # noqa
     if sys.platform == 'linux':
-        pass
+        from .linux import *  # noqa
     elif sys.platform == 'darwin':
         pass
     elif sys.platform == 'cygwin':
@@ -5,17 +5,40 @@ import os
 import subprocess
 import threading
 import weakref
+import zlib
 import abc
+import array
+import codecs
+import io
+import json
+import mmap
+import collections
 import collections.abc
+import functools
+import hashlib
+import queue
+import re
+import shutil
 import signal
+import tempfile
+import time
 __all__ = (
     # Base primitives
     'Process', 'ProcessGroup', 'Pipe', 'PseudoTerminal', 'VirtualProcess',
-    'ThreadedVirtualProcess',
+    'ThreadedVirtualProcess', 'MapResult', 'ShutdownReport', 'CaptureResult', 'OpenFd',
+    'claim', 'open_fds', 'OutputCache',
     # Constants
     'INIT', 'RUNNING', 'PAUSED', 'FINISHED',
     # Plumbing
-    'Tee', 'Valve', 'QuickConnect',
+    'Tee', 'Valve', 'QuickConnect', 'Multiplexer', 'BufferPool', 'IOStats',
+    'DelimitedFramer', 'LengthPrefixFramer', 'Watcher', 'PatternMatch', 'TextDecoder',
+    'Compressor', 'Decompressor', 'FileSink', 'MappedCapture', 'Source', 'ProgressMeter',
+    'ProgressReport', 'TimedCapture', 'TimedChunk',
+    # Events
+    'Event', 'EventStream', 'EventQueue', 'events',
+    'SPAWNED', 'EXITED', 'STOPPED', 'CONTINUED', 'CONNECTOR_EOF', 'CONNECTOR_ERROR',
+    # Tracing
+    'Tracer',
 )
 
 INIT = "init"
@@ -25,15 +48,29 @@ FINISHED = "finished"
 
 
 class Process:
+    """
+    A child process.
+
+    Besides standard I/O, ``fds`` may map more of the child's file descriptor
+    numbers (3 and up) to files (or file descriptors) of this process, eg
+    ``fds={3: pipe.side_out}``. Everything else is closed in the child. Not
+    supported on all platforms.
+    """
     def __init__(self, cmd, *, stdin=None, stdout=None, stderr=None,
-                 cwd=None, environ=None):
+                 cwd=None, environ=None, fds=None):
         self.cmd = cmd
         self.stdin = stdin
         self.stdout = stdout
         self.stderr = stderr
         self.cwd = cwd
         self.environ = environ
+        if fds and min(fds) < 3:
+            raise ValueError("Use stdin, stdout and stderr for descriptors 0-2")
+        self.fds = fds
         self._proc = None
+        self._state = INIT
+        self._state_lock = threading.Lock()
+        self._finished = threading.Event()
 
     def signal(self, sig):
         """
@@ -89,13 +126,43 @@ class Process:
         * PAUSED: The process is paused
         * FINISHED: The process has exited
         """
-        if self._proc is None:
-            return INIT
-        elif self._proc.returncode is not None:
-            return FINISHED
-        else:
-            # TODO: How to tell if a process is currently stopped?
-            return RUNNING
+        if self._state != FINISHED and self._proc is not None \
+                and self._proc.returncode is not None:
+            self._set_state(FINISHED)
+        return self._state
+
+    def _set_state(self, state):
+        """
+        Record a change of status, and tell the process group about it.
+        """
+        with self._state_lock:
+            old, self._state = self._state, state
+        if old == state:
+            return
+        if state == FINISHED:
+            self._finished.set()
+        if hasattr(self, '_process_group'):
+            group = self._process_group()
+            if group is not None:
+                group._member_changed(self, old, state)
+        if events:
+            if state == FINISHED:
+                events.emit(EXITED, self, self.pid, self._pgid_hint(),
+                            return_code=self.return_code, signal=self._exit_signal())
+            else:
+                events.emit(_state_event(old, state), self, self.pid, self._pgid_hint())
+
+    def _pgid_hint(self):
+        """
+        The process group ID to report in events, without asking the kernel.
+        """
+        return None
+
+    def _exit_signal(self):
+        """
+        The signal that ended the process, if there was one.
+        """
+        return None
 
     @property
     def pid(self):
@@ -118,14 +185,201 @@ class Process:
         """
         Start the process.
         """
+        if self.fds:
+            raise NotImplementedError("fds isn't supported on this platform")
         self._proc = subprocess.Popen(
             self.cmd, stdin=self.stdin, stdout=self.stdout, stderr=self.stderr,
             cwd=self.cwd, env=self.environ
         )
+        self._hand_over()
+        self._set_state(RUNNING)
 
-    def join(self):
-        if self._proc is not None:
-            self._proc.wait()
+    def _hand_over(self):
+        """
+        Just started: close this process's copies of the files the child was
+        given, unless they're claimed. If a process group is starting several
+        members, it does so once they've all started.
+        """
+        files = [self.stdin, self.stdout, self.stderr] + list((self.fds or {}).values())
+        closable = _handed_over(files, self.pid)
+        deferred = getattr(self, '_deferred_close', None)
+        if deferred is not None:
+            deferred.extend(closable)
+        else:
+            for f in closable:
+                f.close()
+
+    def join(self, timeout=None):
+        """
+        Wait for the process to finish, for at most ``timeout`` seconds if
+        given. Check ``status`` to see if it did.
+        """
+        if self._proc is not None and self._wait_exit(timeout):
+            self._set_state(FINISHED)
+
+    def _wait_exit(self, timeout):
+        """
+        Wait for the process to exit and reap it. Returns False on timeout.
+        """
+        try:
+            self._proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        else:
+            return True
+
+    def capture(self, input=None, *, limit=None, timeout=None):
+        """
+        Start the process, feed it ``input`` (bytes) if given, collect its
+        standard output and error, and wait for it to finish.
+
+        Streams that are already set aren't collected. At most ``limit`` bytes
+        of each stream are kept; the rest is read and thrown away. If the
+        process (and anything else holding its output) hasn't finished within
+        ``timeout`` seconds, it's killed.
+
+        Returns a :class:`CaptureResult`.
+        """
+        if self.started:
+            raise ValueError("Process has already started")
+        if input is not None and self.stdin is not None:
+            raise ValueError("Can't give input when stdin is already set")
+        sources = {}
+        for name in ('stdout', 'stderr'):
+            if getattr(self, name) is None:
+                pipe = Pipe()
+                setattr(self, name, pipe.side_in)
+                sources[name] = pipe.side_out
+        feed = None
+        if input is not None:
+            pipe = Pipe()
+            self.stdin = pipe.side_out
+            feed = pipe.side_in
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self.start()
+            output, truncated, timed_out = self._drain(sources, feed, input, limit, deadline)
+        finally:
+            for f in list(sources.values()) + [feed]:
+                if f is not None:
+                    f.close()
+        if timed_out:
+            self.kill()
+        self.join()
+        return CaptureResult(output.get('stdout'), output.get('stderr'), self.return_code,
+                             truncated, timed_out)
+
+    def _drain(self, sources, feed, input, limit, deadline):
+        """
+        Feed input and collect output for capture(). Returns the output, the
+        names of the truncated streams, and whether the deadline passed.
+
+        This version uses a thread per stream.
+        """
+        output = {name: bytearray() for name in sources}
+        truncated = set()
+
+        def _collect(name):
+            buf = output[name]
+            for chunk in iter(functools.partial(sources[name].read, 65536), b''):
+                if limit is None or len(buf) + len(chunk) <= limit:
+                    buf += chunk
+                else:
+                    buf += chunk[:max(0, limit - len(buf))]
+                    truncated.add(name)
+
+        def _feed():
+            try:
+                feed.write(input)
+                feed.close()
+            except BrokenPipeError:
+                pass
+
+        threads = [threading.Thread(target=_collect, args=(name,), daemon=True)
+                   for name in sources]
+        if feed is not None:
+            threads.append(threading.Thread(target=_feed, daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        timed_out = any(thread.is_alive() for thread in threads)
+        return ({name: bytes(buf) for name, buf in output.items()},
+                tuple(name for name in sources if name in truncated), timed_out)
+
+
+MapResult = collections.namedtuple('MapResult', 'index item process return_code output')
+MapResult.__doc__ = """
+The outcome of one item of ``ProcessGroup.map()``.
+
+* ``index``: The position of the item in the inputs
+* ``item``: The item itself
+* ``process``: The process that was run for it
+* ``return_code``: The return code of that process
+* ``output``: The captured standard output (bytes), or None if not capturing
+"""
+
+
+CaptureResult = collections.namedtuple(
+    'CaptureResult', 'stdout stderr return_code truncated timed_out')
+CaptureResult.__doc__ = """
+The outcome of ``Process.capture()``.
+
+* ``stdout``, ``stderr``: What was collected (bytes), or None if that stream
+  wasn't collected
+* ``return_code``: The return code of the process
+* ``truncated``: The names of the streams that went over the limit
+* ``timed_out``: Whether the process was killed for taking too long
+"""
+
+
+ShutdownReport = collections.namedtuple('ShutdownReport', 'finished terminated killed')
+ShutdownReport.__doc__ = """
+What it took to shut down a process group, as lists of processes:
+
+* ``finished``: Members that had already exited
+* ``terminated``: Members that exited when asked to
+* ``killed``: Members that had to be killed
+"""
+
+
+def _shutdown(groups, grace):
+    """
+    Shut down several process groups at once, giving them all the same grace
+    period. Returns a ShutdownReport for each.
+    """
+    deadline = time.monotonic() + grace
+    plans = []
+    for group in groups:
+        members = [proc for proc in group if isinstance(proc, Process) and proc.started]
+        finished = [proc for proc in members if proc.status == FINISHED]
+        running = [proc for proc in members if proc.status != FINISHED]
+        plans.append((group, finished, running))
+        if running:
+            try:
+                group.terminate()
+                if any(proc.status == PAUSED for proc in running):
+                    # Stopped processes don't act on signals until continued
+                    group.unpause()
+            except ProcessLookupError:
+                # Everything exited in the meantime
+                pass
+
+    reports = []
+    for group, finished, running in plans:
+        for proc in running:
+            proc.join(max(0, deadline - time.monotonic()))
+        survivors = [proc for proc in running if proc.status != FINISHED]
+        if survivors:
+            try:
+                group.kill()
+            except ProcessLookupError:
+                pass
+            for proc in survivors:
+                proc.join()
+        reports.append(ShutdownReport(
+            finished, [proc for proc in running if proc not in survivors], survivors))
+    return reports
 
 
 # Py36: collections.abc.Collection
@@ -139,9 +393,21 @@ class ProcessGroup(collections.abc.Sized, collections.abc.Iterable, collections.
     A process may only be part of one group. If a process is added to a new
     group, it is removed from the old group. Its children may or may not go with
     it.
+
+    Members are indexed by identity and by PID, and the group keeps a count of
+    its members in each status as they change, so membership, lookups and
+    status are constant time no matter how large the group gets.
     """
+    _process_type = Process
+
     def __init__(self):
-        self._procs = list()
+        # Used as an ordered set
+        self._procs = collections.OrderedDict()
+        self._pids = {}
+        # Members that don't report their status changes, eg VirtualProcess
+        self._untracked = []
+        self._counts = dict.fromkeys((INIT, RUNNING, PAUSED, FINISHED), 0)
+        self._lock = threading.Lock()
 
     def __enter__(self):
         return self
@@ -151,7 +417,8 @@ class ProcessGroup(collections.abc.Sized, collections.abc.Iterable, collections.
         pass
 
     def __iter__(self):
-        yield from self._procs
+        # Copy, so members may be added while iterating
+        yield from list(self._procs)
 
     def __len__(self):
         return len(self._procs)
@@ -166,11 +433,182 @@ class ProcessGroup(collections.abc.Sized, collections.abc.Iterable, collections.
         if hasattr(proc, '_process_group'):
             raise ValueError("Cannot move processes between groups")
         proc._process_group = weakref.ref(self)
-        self._procs.append(proc)
+        with self._lock:
+            self._procs[proc] = None
+            if isinstance(proc, Process):
+                self._counts[proc._state] += 1
+                if proc.pid is not None:
+                    self._pids[proc.pid] = proc
+            else:
+                self._untracked.append(proc)
+
+    def _member_changed(self, proc, old, new):
+        """
+        Called by members when their status changes.
+        """
+        if events:
+            before = self.status
+        with self._lock:
+            self._counts[old] -= 1
+            self._counts[new] += 1
+            if old == INIT and proc.pid is not None:
+                self._pids[proc.pid] = proc
+        if events:
+            after = self.status
+            if before != after:
+                events.emit(_state_event(before, after), self, None, getattr(self, 'pgid', None))
+
+    def by_pid(self, pid):
+        """
+        Find the member with the given process ID, or None.
+
+        PIDs are only unique among running processes; a finished member is
+        found until a newer member is given the same PID.
+        """
+        return self._pids.get(pid)
 
     def start(self):
-        for proc in self:
-            proc.start()
+        # Members may share pipe ends, so only close them once all have started
+        closable = []
+        members = [proc for proc in self if isinstance(proc, Process)]
+        for proc in members:
+            proc._deferred_close = closable
+        try:
+            for proc in self:
+                proc.start()
+        finally:
+            for proc in members:
+                del proc._deferred_close
+            for f in closable:
+                f.close()
+
+    def _start_member(self, proc):
+        """
+        Start a single member of an already-running group.
+        """
+        proc.start()
+
+    def map(self, cmd_factory, inputs, *, max_parallel=None, ordered=True, capture=False,
+            encoding=None, errors='strict', newline=None):
+        """
+        Run a command for each of the inputs, a few at a time (like ``xargs -P``).
+
+        ``cmd_factory`` is called with each item and returns either a command
+        or an unstarted process. The processes are added to this group and at
+        most ``max_parallel`` of them (default: the number of CPUs) are running
+        at once. As soon as one exits, the next one is started.
+
+        This is a generator of ``MapResult``. If ``ordered`` is true, results
+        come out in the same order as the inputs; otherwise, in the order the
+        processes finish. If ``capture`` is true, the standard output of each
+        process (that doesn't already have one) is collected into
+        ``MapResult.output``; it's decoded to str as it arrives if ``encoding``
+        is given (see :class:`TextDecoder` for ``errors`` and ``newline``).
+
+        Inputs are consumed lazily. If the generator is closed early, the
+        processes still running are killed.
+        """
+        if max_parallel is None:
+            max_parallel = os.cpu_count() or 1
+        if max_parallel < 1:
+            raise ValueError("max_parallel must be at least 1")
+
+        pending = enumerate(inputs)
+        done = queue.Queue()
+        running = {}  # process: (index, item, output list, reader thread)
+        finished = {}  # index: MapResult, held until its turn when ordered
+        next_index = 0
+        try:
+            while True:
+                while pending is not None and len(running) < max_parallel:
+                    try:
+                        index, item = next(pending)
+                    except StopIteration:
+                        pending = None
+                    else:
+                        proc, output, reader = self._map_spawn(
+                            cmd_factory(item), capture, encoding, errors, newline)
+                        running[proc] = index, item, output, reader
+                        threading.Thread(
+                            target=self._map_watch, args=(proc, done), daemon=True
+                        ).start()
+                if not running:
+                    break
+
+                proc = done.get()
+                index, item, output, reader = running.pop(proc)
+                proc.join()
+                if reader is not None:
+                    reader.join()
+                    output = (b'' if encoding is None else '').join(output)
+                result = MapResult(index, item, proc, proc.return_code, output)
+
+                if not ordered:
+                    yield result
+                else:
+                    finished[index] = result
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+        finally:
+            for proc in running:
+                proc.kill()
+            for proc in running:
+                proc.join()
+
+    def _map_spawn(self, cmd, capture, encoding=None, errors='strict', newline=None):
+        """
+        Add and start one process for map(), with its output capture if asked.
+        """
+        if isinstance(cmd, (Process, VirtualProcess)):
+            proc = cmd
+        else:
+            proc = self._process_type(cmd)
+
+        pipe = None
+        if capture and isinstance(proc, Process) and proc.stdout is None:
+            pipe = Pipe()
+            proc.stdout = pipe.side_in
+
+        self.add(proc)
+        try:
+            self._start_member(proc)
+        except BaseException:
+            if pipe is not None:
+                pipe.side_out.close()
+            raise
+        finally:
+            if pipe is not None:
+                pipe.side_in.close()
+
+        if pipe is None:
+            return proc, None, None
+
+        output = []
+
+        def _read():
+            with pipe.side_out:
+                if encoding is None:
+                    output.append(pipe.side_out.read())
+                    return
+                decoder = TextDecoder(
+                    output.append, encoding=encoding, errors=errors, newline=newline)
+                for chunk in iter(functools.partial(pipe.side_out.read, 65536), b''):
+                    decoder(chunk)
+                decoder.finish()
+
+        reader = threading.Thread(target=_read, daemon=True)
+        reader.start()
+        return proc, output, reader
+
+    def _map_watch(self, proc, done):
+        """
+        Thread body for map(): report the process on the queue when it exits.
+        """
+        try:
+            proc.join()
+        finally:
+            done.put(proc)
 
     @property
     def status(self):
@@ -179,18 +617,31 @@ class ProcessGroup(collections.abc.Sized, collections.abc.Iterable, collections.
 
         * INIT: The process group has not yet started
         * RUNNING: The process group is currently running
+        * PAUSED: Some processes are paused, and none are running
         * FINISHED: All the processes have exited
         """
-        if all(p.status == FINISHED for p in self):
+        counts = self._counts
+        if self._untracked:
+            counts = dict(counts)
+            for proc in self._untracked:
+                counts[proc.status] = counts.get(proc.status, 0) + 1
+        total = len(self)
+
+        if counts[FINISHED] == total:
             return FINISHED
-        elif all(p.status == INIT for p in self):
+        elif counts[INIT] == total:
             return INIT
+        elif counts[PAUSED] and not counts[RUNNING]:
+            return PAUSED
         else:
             return RUNNING
 
     @property
     def started(self):
-        return self.pgid is not None
+        """
+        Has any process in the group started?
+        """
+        return self._counts[INIT] < len(self) - len(self._untracked)
 
     def signal(self, signal):
         """
@@ -229,12 +680,27 @@ class ProcessGroup(collections.abc.Sized, collections.abc.Iterable, collections.
         for proc in self:
             proc.unpause()
 
-    def join(self):
+    def join(self, timeout=None):
         """
-        Wait for all the processes to finish.
+        Wait for all the processes to finish, for at most ``timeout`` seconds
+        in total if given. Check ``status`` to see if they did.
         """
-        for proc in self:
-            proc.join()
+        if timeout is None:
+            for proc in self:
+                proc.join()
+        else:
+            deadline = time.monotonic() + timeout
+            for proc in self:
+                proc.join(max(0, deadline - time.monotonic()))
+
+    def shutdown(self, grace=5.0):
+        """
+        Stop all the processes: ask them to exit, wait up to ``grace`` seconds
+        for them to do so, and then kill any that are left.
+
+        Returns a ``ShutdownReport`` of which members needed which step.
+        """
+        return _shutdown([self], grace)[0]
 
 
 class VirtualProcess(abc.ABC):
@@ -251,9 +717,10 @@ class VirtualProcess(abc.ABC):
         """
 
     @abc.abstractmethod
-    def join(self):
+    def join(self, timeout=None):
         """
-        Wait for the process to die or pause.
+        Wait for the process to die or pause, for at most ``timeout`` seconds
+        if given.
         """
 
     @abc.abstractmethod
@@ -327,24 +794,461 @@ class ThreadedVirtualProcess(threading.Thread, VirtualProcess):
         pass
 
 
+class OutputCache:
+    """
+    Remembers what deterministic commands output, so running one again with
+    the same inputs replays the result instead of starting a process.
+
+    An entry is keyed on the command line, the executable (its path,
+    modification time and size), the working directory, the environment
+    variables named in ``env``, and the input. Only use this for commands
+    whose output depends on nothing else.
+
+    Entries are files in ``directory``, which may be shared between
+    processes. Once they add up to more than ``max_size`` bytes, the least
+    recently used are removed.
+
+    ``hits``, ``misses`` and ``evictions`` count what this cache has done.
+    """
+    def __init__(self, directory, *, max_size=64 * 1024 * 1024, env=()):
+        self.directory = directory
+        self.max_size = max_size
+        self.env = tuple(env)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # key -> size, least recently used first. Use is recorded as mtime.
+        self._entries = collections.OrderedDict()
+        found = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.out') and entry.is_file():
+                st = entry.stat()
+                found.append((st.st_mtime_ns, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+        self.size = sum(self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.out')
+
+    def key(self, proc, input=None):
+        """
+        The cache key of running a process with the given input, or None if
+        its executable can't be found.
+        """
+        environ = os.environ if proc.environ is None else proc.environ
+        cwd = os.path.abspath(os.getcwd() if proc.cwd is None else proc.cwd)
+        exe = proc.cmd[0]
+        if os.path.dirname(exe):
+            exe = os.path.join(cwd, exe)
+        else:
+            exe = shutil.which(exe, path=environ.get('PATH', os.defpath))
+        if exe is None:
+            return None
+        try:
+            exe = os.path.realpath(exe)
+            st = os.stat(exe)
+        except OSError:
+            return None
+        ident = json.dumps({
+            'cmd': [os.fsdecode(arg) for arg in proc.cmd],
+            'exe': [exe, st.st_mtime_ns, st.st_size],
+            'cwd': cwd,
+            'env': {name: environ.get(name) for name in self.env},
+            'input': None if input is None else hashlib.sha256(input).hexdigest(),
+        }, sort_keys=True)
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    def capture(self, proc, input=None, *, limit=None, timeout=None):
+        """
+        Like ``proc.capture()``, but replayed from the cache if possible. On a
+        hit, the process isn't started.
+
+        Results that were truncated or timed out aren't cached, nor is
+        anything run with its own standard input.
+        """
+        key = None if proc.stdin is not None else self.key(proc, input)
+        if key is not None:
+            result = self._load(key, proc)
+            if result is not None and (limit is None or all(
+                    len(data) <= limit for data in result[:2] if data is not None)):
+                with self._lock:
+                    self.hits += 1
+                return result
+        with self._lock:
+            self.misses += 1
+        result = proc.capture(input, limit=limit, timeout=timeout)
+        if key is not None and not result.truncated and not result.timed_out:
+            self._store(key, result)
+        return result
+
+    def _load(self, key, proc):
+        """
+        Read an entry, marking it used. Returns None if there isn't one, or
+        it doesn't fit what the process would collect.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                header = json.loads(f.readline().decode('utf-8'))
+                stdout = None if header['stdout'] is None else f.read(header['stdout'])
+                stderr = None if header['stderr'] is None else f.read(header['stderr'])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        # Whether a stream was collected depends on the process, not the key
+        if (stdout is None) != (proc.stdout is not None) or \
+                (stderr is None) != (proc.stderr is not None):
+            return None
+        with self._lock:
+            # It may have been written by another process
+            self.size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+        return CaptureResult(stdout, stderr, header['return_code'], (), False)
+
+    def _store(self, key, result):
+        header = json.dumps({
+            'stdout': None if result.stdout is None else len(result.stdout),
+            'stderr': None if result.stderr is None else len(result.stderr),
+            'return_code': result.return_code,
+        }).encode('utf-8') + b'\n'
+        size = len(header) + sum(len(data) for data in result[:2] if data is not None)
+        if size > self.max_size:
+            return
+        # Written aside and renamed into place, so readers never see part of it
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                                         delete=False) as f:
+            f.write(header)
+            for data in result[:2]:
+                if data is not None:
+                    f.write(data)
+        os.replace(f.name, self._path(key))
+        with self._lock:
+            self.size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            while self._entries:
+                key, _ = self._entries.popitem()
+                try:
+                    os.unlink(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self.size = 0
+
+
 ##################
 # {{{ Plumbing
 ##################
 
+class BufferPool:
+    """
+    Preallocated, reusable buffers, so plumbing doesn't allocate for every
+    chunk it moves.
+
+    Use ``BufferPool.shared(size)`` to get the pool shared by all plumbing
+    using that size of chunk.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, size, keep=1024):
+        self.size = size
+        self.keep = keep
+        self.allocations = 0
+        self._free = collections.deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, size):
+        with cls._shared_lock:
+            if size not in cls._shared:
+                cls._shared[size] = cls(size)
+            return cls._shared[size]
+
+    def acquire(self, count, stats=None):
+        """
+        Get a list of ``count`` buffers. New allocations are counted in stats.
+        """
+        bufs = []
+        for _ in range(count):
+            try:
+                bufs.append(self._free.pop())
+            except IndexError:
+                bufs.append(bytearray(self.size))
+                with self._lock:
+                    self.allocations += 1
+                if stats is not None:
+                    stats.allocations += 1
+        return bufs
+
+    def release(self, bufs):
+        """
+        Give buffers back to the pool. They must not be used afterwards.
+        """
+        for buf in bufs:
+            if len(self._free) >= self.keep:
+                break
+            self._free.append(buf)
+
+
+class IOStats:
+    """
+    Counters of the work done by a piece of plumbing.
+
+    * ``bytes``: How much data was read
+    * ``reads``: Read calls; each is one system call when reading a file descriptor
+    * ``writes``: Write calls, likewise
+    * ``allocations``: Buffers and chunks allocated
+    """
+    def __init__(self):
+        self.bytes = self.reads = self.writes = self.allocations = 0
+
+    def __repr__(self):
+        return '<{} bytes={} reads={} writes={} allocations={}>'.format(
+            type(self).__name__, self.bytes, self.reads, self.writes, self.allocations)
+
+    def per_mb(self):
+        """
+        Reads, writes and allocations per MiB moved, as a dict.
+        """
+        mb = self.bytes / (1024 * 1024)
+        return {
+            name: getattr(self, name) / mb if mb else 0.0
+            for name in ('reads', 'writes', 'allocations')
+        }
+
+
+def _vector_fd(f):
+    """
+    The file descriptor to do vectored I/O on, or None to use the file's methods.
+
+    Only unbuffered files qualify, since anything buffered would be skipped.
+    """
+    if _HAVE_VECTOR and isinstance(f, io.FileIO):
+        return f.fileno()
+
+
+_HAVE_VECTOR = hasattr(os, 'readv') and hasattr(os, 'writev')
+
+
+def _read_chunks(f, views, stats):
+    """
+    Read what's available into the buffers (memoryviews), with one system call
+    if possible.
+
+    Returns the chunks that were filled, which are slices of the buffers unless
+    the file can't read into buffers. Empty at EOF.
+    """
+    stats.reads += 1
+    fd = _vector_fd(f)
+    if fd is not None:
+        size = os.readv(fd, views)
+    elif hasattr(f, 'readinto'):
+        size = f.readinto(views[0])
+    else:
+        # Eg, text files
+        chunk = f.read(len(views[0]))
+        stats.bytes += len(chunk)
+        stats.allocations += 1
+        return [chunk] if chunk else []
+
+    stats.bytes += size
+    chunks = []
+    for view in views:
+        if size <= 0:
+            break
+        chunks.append(view[:size])
+        size -= len(view)
+    return chunks
+
+
+def _limit_views(views, size):
+    """
+    Trim a list of buffers to hold at most size bytes in total.
+    """
+    full, rest = divmod(size, len(views[0]))
+    if full >= len(views):
+        return views
+    limited = views[:full]
+    if rest:
+        limited.append(views[full][:rest])
+    return limited
+
+
+def _joined(chunks, stats):
+    """
+    Combine chunks into a single bytes (or whatever the file gave).
+    """
+    if len(chunks) == 1 and not isinstance(chunks[0], memoryview):
+        return chunks[0]
+    stats.allocations += 1
+    return b''.join(chunks)
+
+
+def _write_chunks(f, chunks, stats):
+    """
+    Write all of the chunks, with as few system calls as possible.
+    """
+    fd = _vector_fd(f)
+    if fd is None:
+        for chunk in chunks:
+            stats.writes += 1
+            f.write(chunk)
+        return
+
+    chunks = list(chunks)
+    while chunks:
+        stats.writes += 1
+        written = os.writev(fd, chunks)
+        # Drop what got written; keep the rest of a partly written chunk
+        while chunks and written >= len(chunks[0]):
+            written -= len(chunks.pop(0))
+        if written:
+            chunks[0] = memoryview(chunks[0])[written:]
+
+
+def _pooled_views(connector):
+    """
+    Get a connector's buffers from the pool: ``VECTOR`` of ``CHUNKSIZE`` each.
+
+    Returns the buffers, to give back with ``_release_views()``, and views of
+    them, to read into.
+    """
+    bufs = BufferPool.shared(connector.CHUNKSIZE).acquire(connector.VECTOR, connector.stats)
+    return bufs, [memoryview(buf) for buf in bufs]
+
+
+def _release_views(connector, bufs):
+    BufferPool.shared(connector.CHUNKSIZE).release(bufs)
+
+
+def _run_connector(connector):
+    """
+    Thread body for plumbing: run its loop, and publish how it ended.
+    """
+    try:
+        connector._thread()
+    except Exception as exc:
+        if events:
+            events.emit(CONNECTOR_ERROR, connector, error=exc)
+        raise
+    else:
+        if events:
+            events.emit(CONNECTOR_EOF, connector)
+
+
 class Pipe:
     """
     A one-way byte stream.
+
+    When an end is handed to a child process (as its ``stdin``, ``stdout``,
+    ``stderr`` or one of its ``fds``), this process's copy is closed once the
+    child has started, unless it's been claimed with :func:`claim`. (A
+    ``ProcessGroup`` waits until all its members have started.)
     """
     def __init__(self):
         r, w = self._mkpipe()
         self.side_in = os.fdopen(w, 'wb', buffering=0)
         self.side_out = os.fdopen(r, 'rb', buffering=0)
+        _track(self.side_in, 'pipe write end')
+        _track(self.side_out, 'pipe read end')
 
     @staticmethod
     def _mkpipe():
         return os.pipe()
 
 
+OpenFd = collections.namedtuple('OpenFd', 'fd file kind claimed pids')
+OpenFd.__doc__ = """
+A file created by slug that's still open in this process.
+
+* ``fd``: Its file descriptor
+* ``file``: The file object
+* ``kind``: What it is, eg ``'pipe read end'``
+* ``claimed``: Whether it's been claimed, so isn't closed automatically
+* ``pids``: The processes it's been handed to
+"""
+
+# Files slug made: file: [kind, claimed, pids]
+_tracked = weakref.WeakKeyDictionary()
+_tracked_lock = threading.Lock()
+
+
+def _track(f, kind):
+    """
+    Register a file that slug made, to be closed after handing it to a child.
+    """
+    with _tracked_lock:
+        _tracked[f] = [kind, False, []]
+
+
+def claim(f):
+    """
+    Keep a file open after it's handed to a child process, because this
+    process still uses it. Plumbing claims the files it reads and writes.
+    """
+    with _tracked_lock:
+        info = _tracked.get(f)
+        if info is not None:
+            info[1] = True
+
+
+def _handed_over(files, pid):
+    """
+    Record that files were given to a child, and return the ones that this
+    process can now close.
+    """
+    closable = []
+    with _tracked_lock:
+        for f in files:
+            try:
+                info = _tracked.get(f)
+            except TypeError:
+                # Not hashable, so not ours
+                continue
+            if info is not None:
+                info[2].append(pid)
+                if not info[1]:
+                    closable.append(f)
+    return closable
+
+
+def open_fds():
+    """
+    List the files slug made that are still open, as :class:`OpenFd`, to
+    help track down leaks.
+    """
+    with _tracked_lock:
+        items = list(_tracked.items())
+    return sorted(
+        (OpenFd(f.fileno(), f, kind, claimed, list(pids))
+         for f, (kind, claimed, pids) in items if not f.closed),
+        key=lambda o: o.fd)
+
+
 class PseudoTerminal:
     """
     A two-way byte stream, with extras.
@@ -353,6 +1257,164 @@ class PseudoTerminal:
         self.side_master, self.side_slave = NotImplemented, NotImplemented
 
 
+class DelimitedFramer:
+    """
+    Splits a stream into records ending with ``delimiter``: lines by default,
+    or eg ``b'\\0'`` for NUL-separated records.
+
+    Records include the delimiter if ``keepends``. A record longer than
+    ``max_record`` (not counting the delimiter) is split into pieces of that
+    size, so a missing delimiter can't use unbounded memory. At EOF, any
+    unterminated remainder is the last record.
+
+    Each framer keeps the state of one stream.
+    """
+    def __init__(self, delimiter=b'\n', *, keepends=True, max_record=None):
+        if not delimiter:
+            raise ValueError("delimiter must not be empty")
+        self.delimiter = delimiter
+        self.keepends = keepends
+        self.max_record = max_record
+        self._carry = bytearray()
+        self._scanned = 0  # Where to resume looking for a delimiter
+
+    def feed(self, data):
+        """
+        Add some data, and return the records it completed.
+        """
+        buf = self._carry
+        buf += data
+        records = []
+        start = 0
+        dlen = len(self.delimiter)
+        while True:
+            end = buf.find(self.delimiter, max(start, self._scanned))
+            # The length of the record, not counting the delimiter
+            length = len(buf) - start if end == -1 else end - start
+            limit = self.max_record
+            if limit is not None and length > limit:
+                records.append(bytes(buf[start:start + limit]))
+                start += limit
+                continue
+            if end == -1:
+                break
+            records.append(bytes(buf[start:end + dlen if self.keepends else end]))
+            start = end + dlen
+        del buf[:start]
+        # A delimiter may be split across feeds
+        self._scanned = max(0, len(buf) - dlen + 1)
+        return records
+
+    def end(self):
+        """
+        Return the remaining unterminated record, if any, or None.
+        """
+        rest = bytes(self._carry)
+        self._carry.clear()
+        self._scanned = 0
+        return rest or None
+
+
+class LengthPrefixFramer:
+    """
+    Splits a stream into records that are each preceded by their length, as a
+    ``size``-byte unsigned integer with the given ``byteorder``. The records
+    don't include the length.
+
+    A record declaring more than ``max_record`` bytes raises ValueError, as
+    does a stream ending partway through a record.
+
+    Each framer keeps the state of one stream.
+    """
+    def __init__(self, size=4, byteorder='big', *, max_record=None):
+        self.size = size
+        self.byteorder = byteorder
+        self.max_record = max_record
+        self._carry = bytearray()
+        self._length = None  # Length of the current record, once its header is read
+
+    def feed(self, data):
+        """
+        Add some data, and return the records it completed.
+        """
+        buf = self._carry
+        buf += data
+        records = []
+        start = 0
+        while True:
+            if self._length is None:
+                if len(buf) - start < self.size:
+                    break
+                length = int.from_bytes(buf[start:start + self.size], self.byteorder)
+                if self.max_record is not None and length > self.max_record:
+                    raise ValueError("Record of {} bytes is larger than {}".format(
+                        length, self.max_record))
+                self._length = length
+                start += self.size
+            if len(buf) - start < self._length:
+                break
+            records.append(bytes(buf[start:start + self._length]))
+            start += self._length
+            self._length = None
+        del buf[:start]
+        return records
+
+    def end(self):
+        """
+        Check that the stream ended on a record boundary. Always returns None.
+        """
+        if self._carry or self._length is not None:
+            raise ValueError("Stream ended partway through a record")
+
+
+class TextDecoder:
+    """
+    Decodes a byte stream to text as it arrives, passing the text to any number
+    of consumers (callables taking a str). Each byte is decoded only once, no
+    matter how many consumers there are.
+
+    A character split across chunks is held back until it's complete.
+    ``encoding`` and ``errors`` are as for :meth:`bytes.decode`, and
+    ``newline`` is as for reading from :class:`io.TextIOWrapper`: None
+    translates ``'\\r\\n'`` and ``'\\r'`` to ``'\\n'``; anything else leaves
+    line endings alone.
+
+    Call it with each chunk of bytes, and :meth:`finish` at EOF.
+    """
+    def __init__(self, *consumers, encoding='utf-8', errors='strict', newline=None):
+        if newline not in (None, '', '\n', '\r', '\r\n'):
+            raise ValueError("illegal newline value: {!r}".format(newline))
+        self.consumers = list(consumers)
+        self.encoding = encoding
+        self.errors = errors
+        self.newline = newline
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors)
+        if newline is None:
+            self._decoder = io.IncrementalNewlineDecoder(self._decoder, translate=True)
+
+    def _publish(self, text):
+        if text:
+            for consumer in self.consumers:
+                consumer(text)
+        return text
+
+    def __call__(self, data):
+        """
+        Decode a chunk of bytes, and pass on what text is complete. Returns that
+        text.
+        """
+        return self._publish(self._decoder.decode(data))
+
+    def finish(self):
+        """
+        Decode whatever was held back, at EOF. Raises an error for an incomplete
+        character unless ``errors`` says otherwise.
+        """
+        text = self._decoder.decode(b'', final=True)
+        self._decoder.reset()
+        return self._publish(text)
+
+
 class Tee:
     """
     Forwards from one file-like to another, but a callable is passed all data
@@ -369,58 +1431,323 @@ class Tee:
 
     For these reasons, it is highly recommended that the data be immediately
     handed to a pipe, queue, buffer, etc.
+
+    If ``framing`` is given (eg a :class:`DelimitedFramer`), the callable is
+    passed whole records instead of arbitrary chunks.
+
+    If ``encoding`` is given, the callable is passed str instead of bytes,
+    decoded by a :class:`TextDecoder` (``decoder``) with ``errors`` and
+    ``newline``. To give several consumers the same text, pass a
+    :class:`TextDecoder` as the callable instead.
+
+    If ``highwater`` is given, the Tee is buffered: writing to ``side_out``
+    happens on its own thread, and reading continues into memory while the
+    writes are blocked. Reading only stops once more than ``highwater`` bytes
+    are waiting, and resumes when it drains to ``lowwater`` (default: half of
+    ``highwater``). This absorbs bursts instead of stalling the producer.
+
+    Up to ``VECTOR`` chunks are read or written per system call when there's
+    that much waiting. ``stats`` counts the work done.
     """
     CHUNKSIZE = 4096
+    VECTOR = 16
 
-    def __init__(self, side_in, side_out, callback, eof=None, *, keepopen=False):
+    def __init__(self, side_in, side_out, callback, eof=None, *, keepopen=False,
+                 highwater=None, lowwater=None, framing=None,
+                 encoding=None, errors='strict', newline=None):
         self.side_in = side_in
         self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
         self.callback = callback
         self.eof = eof
+        self.framing = framing
+        self.decoder = None
+        if encoding is not None:
+            self.decoder = TextDecoder(callback, encoding=encoding, errors=errors,
+                                       newline=newline)
         self.keepopen = keepopen
-        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.stats = IOStats()
+        self.highwater = highwater
+        if highwater is not None:
+            self.lowwater = highwater // 2 if lowwater is None else lowwater
+            if not 0 <= self.lowwater <= highwater:
+                raise ValueError("lowwater must be between 0 and highwater")
+            self._buffer = collections.deque()
+            self._buffered = 0
+            self._buffer_cond = threading.Condition()
+            self._failed = False
+            self.drain_thread = threading.Thread(target=self._drain, daemon=True)
+            self.drain_thread.start()
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
         self.thread.start()
 
+    @property
+    def buffered(self):
+        """
+        How many bytes are waiting to be written. Always 0 if unbuffered.
+        """
+        return self._buffered if self.highwater is not None else 0
+
+    def _deliver(self, chunk):
+        """
+        Pass data to the callback, framed and decoded if requested.
+        """
+        sink = self.callback if self.decoder is None else self.decoder
+        if self.framing is None:
+            sink(chunk)
+        else:
+            for record in self.framing.feed(chunk):
+                sink(record)
+
+    def _deliver_end(self):
+        """
+        Pass any final partial record or character to the callback.
+        """
+        sink = self.callback if self.decoder is None else self.decoder
+        if self.framing is not None:
+            rest = self.framing.end()
+            if rest is not None:
+                _traced(self, 'callback', sink, rest)
+        if self.decoder is not None:
+            _traced(self, 'callback', self.decoder.finish)
+
     def _thread(self):
+        if self.highwater is not None:
+            return self._buffered_thread()
+        bufs, views = _pooled_views(self)
         try:
             while True:
-                chunk = self.side_in.read(self.CHUNKSIZE)
-                if chunk in (b'', ''):
+                chunks = _traced(self, 'read', _read_chunks, self.side_in, views, self.stats)
+                if not chunks:
+                    self._deliver_end()
                     break
                 else:
-                    self.callback(chunk)
-                    self.side_out.write(chunk)
+                    chunk = _joined(chunks, self.stats)
+                    _traced(self, 'callback', self._deliver, chunk)
+                    _traced(self, 'write', _write_chunks, self.side_out, [chunk], self.stats)
         finally:
+            _release_views(self, bufs)
             if self.eof is not None:
                 self.eof()
             if not self.keepopen:
                 self.side_out.close()
 
+    def _buffered_thread(self):
+        cond = self._buffer_cond
+        bufs, views = _pooled_views(self)
+        try:
+            while True:
+                with cond:
+                    if self._buffered >= self.highwater:
+                        _traced(self, 'gated', cond.wait_for,
+                                lambda: self._buffered <= self.lowwater or self._failed)
+                    if self._failed:
+                        break
+                    # Don't read much past the high water mark
+                    room = max(1, (self.highwater - self._buffered) // self.CHUNKSIZE)
+                chunks = _traced(
+                    self, 'read', _read_chunks, self.side_in, views[:room], self.stats)
+                if not chunks:
+                    self._deliver_end()
+                    break
+                chunk = _joined(chunks, self.stats)
+                _traced(self, 'callback', self._deliver, chunk)
+                with cond:
+                    self._buffer.append(chunk)
+                    self._buffered += len(chunk)
+                    cond.notify_all()
+        finally:
+            _release_views(self, bufs)
+            with cond:
+                # EOF marker
+                self._buffer.append(None)
+                cond.notify_all()
 
-class Valve:
-    """
-    Forwards from one file-like to another, but this flow may be paused and
-    resumed.
+    def _drain(self):
+        """
+        Thread body for buffered mode: write out what the reader buffered.
+        """
+        cond = self._buffer_cond
+        try:
+            while True:
+                with cond:
+                    cond.wait_for(lambda: self._buffer)
+                    # Write out as much as is waiting, up to VECTOR chunks at once
+                    batch = []
+                    while self._buffer and self._buffer[0] is not None \
+                            and len(batch) < self.VECTOR:
+                        batch.append(self._buffer.popleft())
+                if not batch:
+                    break
+                _traced(self, 'write', _write_chunks, self.side_out, batch, self.stats)
+                with cond:
+                    self._buffered -= sum(map(len, batch))
+                    cond.notify_all()
+        except Exception:
+            with cond:
+                self._failed = True
+                cond.notify_all()
+            raise
+        finally:
+            if self.eof is not None:
+                self.eof()
+            if not self.keepopen:
+                self.side_out.close()
+
+
+PatternMatch = collections.namedtuple('PatternMatch', 'pattern start end data')
+
+
+class Watcher(Tee):
+    """
+    Forwards from one file-like to another, watching for patterns in the data.
+
+    ``patterns`` may contain both byte strings and compiled bytes regexes. For
+    each match, the callable is passed a :class:`PatternMatch` giving the
+    pattern (as it was given), the stream offsets it spans, and the matched
+    bytes. Matches are found across chunk boundaries.
+
+    Every occurrence of every byte string is reported, even overlapping ones.
+    All the byte strings are searched for in one pass, so a large set costs
+    little more than a small one.
+
+    Only the last ``max_span`` bytes are kept for matching, so a regex match
+    longer than that may be missed. A regex whose match could grow with more
+    data (eg ``rb'\\d+'``) may be reported more than once across a chunk
+    boundary; anchoring it to a delimiter (eg ``rb'\\d+\\n'``) avoids this.
+
+    The same caveats about the callable apply as to :class:`Tee`.
+    """
+    def __init__(self, side_in, side_out, patterns, callback, eof=None, *, keepopen=False,
+                 max_span=4096, highwater=None, lowwater=None):
+        self.on_match = callback
+        self.literals = []
+        self.regexes = []
+        for pattern in patterns:
+            if isinstance(pattern, (bytes, bytearray)):
+                if not pattern:
+                    raise ValueError("Patterns must not be empty")
+                self.literals.append(bytes(pattern))
+            else:
+                self.regexes.append(pattern)
+        span = max(map(len, self.literals), default=0)
+        self.max_span = max(span, max_span if self.regexes else 0)
+        self._literal_re = None
+        if self.literals:
+            # Longest first, so that the lookahead finds the longest match at a
+            # position; any others there are prefixes of it.
+            ordered = sorted(set(self.literals), key=len, reverse=True)
+            self._literal_re = re.compile(
+                b'(?=(' + b'|'.join(map(re.escape, ordered)) + b'))')
+            self._prefixes = {
+                lit: [other for other in ordered if other != lit and lit.startswith(other)]
+                for lit in ordered
+            }
+        self._tail = b''
+        self._offset = 0  # Stream offset of the start of _tail
+        super().__init__(side_in, side_out, self._scan, eof, keepopen=keepopen,
+                         highwater=highwater, lowwater=lowwater)
+
+    def _scan(self, chunk):
+        """
+        Tee callback: look for matches that end in this chunk.
+        """
+        window = self._tail + chunk
+        new = len(self._tail)  # Matches must end past here to be new
+        found = []
+        if self._literal_re is not None:
+            for m in self._literal_re.finditer(window):
+                pos = m.start()
+                longest = m.group(1)
+                for lit in [longest] + self._prefixes[longest]:
+                    if pos + len(lit) <= new:
+                        break
+                    found.append((pos, pos + len(lit), lit, lit))
+        for regex in self.regexes:
+            for m in regex.finditer(window):
+                if m.end() > new:
+                    found.append((m.start(), m.end(), regex, m.group()))
+        found.sort(key=lambda f: (f[0], f[1]))
+        for start, end, pattern, data in found:
+            self.on_match(PatternMatch(
+                pattern, self._offset + start, self._offset + end, data))
+        keep = max(0, self.max_span - 1)
+        cut = max(0, len(window) - keep)
+        self._tail = window[cut:]
+        self._offset += cut
+
+
+class Valve:
+    """
+    Forwards from one file-like to another, but this flow may be paused and
+    resumed.
+
+    Nothing is written while the valve is off, not even data that was already
+    being read when it was turned off.
+
+    The flow may also be throttled to ``rate`` bytes per second, allowing
+    bursts of up to ``burst`` bytes (default: a tenth of a second's worth, but
+    at least a chunk). Both may be changed at any time; a rate of None is
+    unlimited.
     """
-    # This implementation is broken. It will read an extra block.
     CHUNKSIZE = 4096
+    VECTOR = 16
 
-    def __init__(self, side_in, side_out, *, keepopen=False):
+    def __init__(self, side_in, side_out, *, keepopen=False, rate=None, burst=None):
         self.side_in = side_in
         self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
         self.gate = threading.Event()
         self.keepopen = keepopen
-        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.rate = rate
+        if burst is None and rate is not None:
+            burst = max(self.CHUNKSIZE, rate // 10)
+        self.burst = burst
+        self._tokens = burst or 0
+        self._last = time.monotonic()
+        self.stats = IOStats()
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
         self.thread.start()
 
+    def _allowance(self):
+        """
+        Wait until the rate limit lets some bytes through, and return how many.
+        """
+        most = self.CHUNKSIZE * self.VECTOR
+        while self.rate is not None:
+            # Token bucket: refill by the time passed, up to the burst size
+            now = time.monotonic()
+            burst = self.burst or self.CHUNKSIZE
+            self._tokens = min(burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                return min(int(self._tokens), most)
+            _traced(self, 'throttled', time.sleep, (1 - self._tokens) / self.rate)
+        return most
+
+    def _spend(self, chunks):
+        """
+        Take what was read out of the token bucket.
+        """
+        if self.rate is not None:
+            self._tokens -= sum(map(len, chunks))
+
     def _thread(self):
+        bufs, views = _pooled_views(self)
         while True:
-            chunk = self.side_in.read(self.CHUNKSIZE)
-            if chunk in (b'', ''):
+            _traced(self, 'gated', self.gate.wait)
+            chunks = _traced(self, 'read', _read_chunks, self.side_in,
+                             _limit_views(views, self._allowance()), self.stats)
+            if not chunks:
                 break
             else:
-                self.side_out.write(chunk)
-                self.gate.wait()
+                self._spend(chunks)
+                # The valve may have been turned off while we were reading
+                _traced(self, 'gated', self.gate.wait)
+                _traced(self, 'write', _write_chunks, self.side_out, chunks, self.stats)
+        _release_views(self, bufs)
         if not self.keepopen:
             self.side_out.close()
 
@@ -457,22 +1784,1373 @@ class QuickConnect:
 
     # This implementation is broken. It will read an extra block.
     CHUNKSIZE = 4096
+    VECTOR = 16
 
     def __init__(self, side_in, side_out, *, keepopen=True):
         self.side_in = side_in
         self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
         self.keepopen = keepopen
-        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.stats = IOStats()
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
         self.thread.start()
 
     def _thread(self):
+        bufs, views = _pooled_views(self)
         while True:
-            chunk = self.side_in.read(self.CHUNKSIZE)
-            if chunk in (b'', ''):
+            chunks = _traced(self, 'read', _read_chunks, self.side_in, views, self.stats)
+            if not chunks:
                 break
             else:
-                self.side_out.write(chunk)
+                _traced(self, 'write', _write_chunks, self.side_out, chunks, self.stats)
+        _release_views(self, bufs)
         if not self.keepopen:
             self.side_out.close()
 
+
+class Multiplexer:
+    """
+    Merges several inputs into one output.
+
+    If ``lines`` is true, only whole lines are written, so lines from different
+    inputs are never mixed together (a line longer than ``LINE_MAX`` is split).
+    Otherwise, each chunk read from an input is written out whole.
+
+    Inputs may be added and removed at any time; nothing read from an input is
+    lost or repeated. An input is removed automatically at EOF, and when the
+    last input is removed that way, ``side_out`` is closed (unless
+    ``keepopen``).
+
+    NOTE: This implementation reads each input on its own thread. A removed
+    input is still read one more time, and that data is forwarded before the
+    removal takes effect.
+    """
+    CHUNKSIZE = 4096
+    VECTOR = 16
+    LINE_MAX = 65536
+
+    def __init__(self, side_out, inputs=(), *, lines=False, keepopen=False):
+        self.side_out = side_out
+        claim(side_out)
+        self.lines = lines
+        self.keepopen = keepopen
+        self.stats = IOStats()
+        self._carries = {}  # input: partial line, for line mode
+        self._write_lock = threading.Lock()
+        self._removed = set()
+        for side_in in inputs:
+            self.add(side_in)
+
+    @property
+    def inputs(self):
+        """
+        The inputs currently being merged.
+        """
+        return list(self._carries)
+
+    def add(self, side_in):
+        """
+        Start merging an input.
+        """
+        claim(side_in)
+        self._carries[side_in] = bytearray()
+        threading.Thread(target=self._pump, args=(side_in,), daemon=True).start()
+
+    def remove(self, side_in):
+        """
+        Stop merging an input. Any partial line is written out.
+        """
+        self._removed.add(side_in)
+
+    def _pump(self, side_in):
+        """
+        Thread body: forward one input.
+        """
+        bufs, views = _pooled_views(self)
+        try:
+            while side_in not in self._removed:
+                chunks = _traced(self, 'read', _read_chunks, side_in, views, self.stats)
+                if not chunks:
+                    break
+                with self._write_lock:
+                    self._forward(side_in, chunks)
+        finally:
+            _release_views(self, bufs)
+            with self._write_lock:
+                eof = side_in not in self._removed
+                self._removed.discard(side_in)
+                self._detach(side_in, eof)
+
+    def _forward(self, side_in, chunks):
+        """
+        Write out what was read from an input, holding back any partial line.
+        """
+        if not self.lines:
+            _traced(self, 'write', _write_chunks, self.side_out, chunks, self.stats)
+            return
+        carry = self._carries[side_in]
+        data = _joined(chunks, self.stats)
+        end = data.rfind(b'\n') + 1
+        if not end and len(carry) + len(data) <= self.LINE_MAX:
+            carry += data
+            return
+        if not end:
+            end = len(data)
+        _traced(self, 'write', _write_chunks, self.side_out,
+                [carry, memoryview(data)[:end]], self.stats)
+        self._carries[side_in] = bytearray(data[end:])
+
+    def _detach(self, side_in, eof):
+        """
+        Forget an input, flushing its partial line. Closes the output if this
+        was the last input and it reached EOF.
+        """
+        carry = self._carries.pop(side_in, None)
+        if carry:
+            _traced(self, 'write', _write_chunks, self.side_out, [carry], self.stats)
+        if eof and not self._carries and not self.keepopen:
+            self.side_out.close()
+
+
+def _compressor(format, level):
+    """
+    Make a compression object for the format: ``(compress, flush, end)``
+    functions. ``flush`` makes what's been compressed so far decodable.
+    """
+    if format in ('zlib', 'gzip'):
+        obj = zlib.compressobj(
+            -1 if level is None else level, zlib.DEFLATED,
+            zlib.MAX_WBITS | (16 if format == 'gzip' else 0))
+        return obj.compress, lambda: obj.flush(zlib.Z_SYNC_FLUSH), obj.flush
+    elif format == 'lzma':
+        import lzma
+        factory = functools.partial(lzma.LZMACompressor, preset=level)
+    elif format == 'bz2':
+        import bz2
+        factory = functools.partial(bz2.BZ2Compressor, 9 if level is None else level)
+    else:
+        raise ValueError("Unknown compression format: {!r}".format(format))
+
+    # These can't flush partway, so flushing ends the stream and starts another
+    obj = factory()
+
+    def flush():
+        nonlocal obj
+        data = obj.flush()
+        obj = factory()
+        return data
+
+    return (lambda data: obj.compress(data)), flush, lambda: obj.flush()
+
+
+def _decompressor(format):
+    """
+    Make a decompression object for the format.
+    """
+    if format == 'zlib':
+        return zlib.decompressobj()
+    elif format == 'gzip':
+        return zlib.decompressobj(zlib.MAX_WBITS | 16)
+    elif format == 'lzma':
+        import lzma
+        return lzma.LZMADecompressor()
+    elif format == 'bz2':
+        import bz2
+        return bz2.BZ2Decompressor()
+    else:
+        raise ValueError("Unknown compression format: {!r}".format(format))
+
+
+class Compressor:
+    """
+    Forwards from one file-like to another, compressing the data.
+
+    ``format`` is one of ``'gzip'``, ``'zlib'``, ``'lzma'`` or ``'bz2'``, and
+    ``level`` is the format's compression level or preset.
+
+    Up to ``VECTOR`` chunks are compressed at once, which lets the compressor
+    work without holding the GIL.
+
+    If ``flush_interval`` is given, what's been compressed so far is flushed
+    to ``side_out`` at least that often (in seconds), so a reader can
+    decompress the output before it's complete. lzma and bz2 can only do this
+    by starting a new stream; :class:`Decompressor` and the command line
+    tools accept such concatenated streams.
+    """
+    CHUNKSIZE = 4096
+    VECTOR = 64
+
+    def __init__(self, side_in, side_out, format='gzip', *, level=None, flush_interval=None,
+                 keepopen=False):
+        self.side_in = side_in
+        self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
+        self.format = format
+        self.level = level
+        self.flush_interval = flush_interval
+        self.keepopen = keepopen
+        self.stats = IOStats()
+        self._compress, self._flush, self._end = _compressor(format, level)
+        self._lock = threading.Lock()
+        self._dirty = False  # Compressed data is held back
+        self._done = threading.Event()
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+        if flush_interval is not None:
+            threading.Thread(target=self._flusher, daemon=True).start()
+
+    def _thread(self):
+        bufs, views = _pooled_views(self)
+        try:
+            while True:
+                chunks = _traced(self, 'read', _read_chunks, self.side_in, views, self.stats)
+                if not chunks:
+                    break
+                data = _joined(chunks, self.stats)
+                with self._lock:
+                    out = _traced(self, 'compress', self._compress, data)
+                    self._dirty = True
+                    if out:
+                        _traced(self, 'write', _write_chunks, self.side_out, [out], self.stats)
+            with self._lock:
+                out = _traced(self, 'compress', self._end)
+                if out:
+                    _traced(self, 'write', _write_chunks, self.side_out, [out], self.stats)
+        finally:
+            self._done.set()
+            _release_views(self, bufs)
+            if not self.keepopen:
+                self.side_out.close()
+
+    def _flusher(self):
+        """
+        Thread body: flush periodically.
+        """
+        while not self._done.wait(self.flush_interval):
+            with self._lock:
+                if self._done.is_set() or not self._dirty:
+                    continue
+                out = _traced(self, 'flush', self._flush)
+                self._dirty = False
+                if out:
+                    _traced(self, 'write', _write_chunks, self.side_out, [out], self.stats)
+
+
+class Decompressor:
+    """
+    Forwards from one file-like to another, decompressing the data.
+
+    ``format`` is one of ``'gzip'``, ``'zlib'``, ``'lzma'`` or ``'bz2'``.
+    Several concatenated streams are decompressed one after another. If the
+    input ends partway through a stream, the connector fails with EOFError.
+    """
+    CHUNKSIZE = 4096
+    VECTOR = 64
+
+    def __init__(self, side_in, side_out, format='gzip', *, keepopen=False):
+        self.side_in = side_in
+        self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
+        self.format = format
+        self.keepopen = keepopen
+        self.stats = IOStats()
+        self._decompressor = _decompressor(format)
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+
+    def _thread(self):
+        bufs, views = _pooled_views(self)
+        partial = False  # Partway through a stream
+        try:
+            while True:
+                chunks = _traced(self, 'read', _read_chunks, self.side_in, views, self.stats)
+                if not chunks:
+                    break
+                data = _joined(chunks, self.stats)
+                while data:
+                    partial = True
+                    out = _traced(self, 'decompress', self._decompressor.decompress, data)
+                    if out:
+                        _traced(self, 'write', _write_chunks, self.side_out, [out], self.stats)
+                    data = b''
+                    if self._decompressor.eof:
+                        # Start on the next stream, if there is one
+                        partial = False
+                        data = self._decompressor.unused_data
+                        self._decompressor = _decompressor(self.format)
+            if partial:
+                raise EOFError("Compressed stream ended before the end-of-stream marker")
+        finally:
+            _release_views(self, bufs)
+            if not self.keepopen:
+                self.side_out.close()
+
+
+ProgressReport = collections.namedtuple('ProgressReport', 'bytes rate elapsed preview eof')
+ProgressReport.__doc__ = """
+How far a :class:`ProgressMeter` has got.
+
+* ``bytes``: The total forwarded so far
+* ``rate``: Bytes per second since the previous report
+* ``elapsed``: Seconds since the meter started
+* ``preview``: The end of the last line seen (bytes, at most ``preview`` long)
+* ``eof``: Whether this is the final report
+"""
+
+
+class ProgressMeter:
+    """
+    Forwards from one file-like to another untouched, calling ``callback``
+    with a :class:`ProgressReport` every ``every`` bytes and every
+    ``interval`` seconds (either may be None), and once more at the end.
+
+    Between reports, all that's done for each full read is to count it, so
+    this is cheap enough for long, fast transfers.
+
+    Reports are made from the forwarding thread, except when no data has
+    arrived for a whole interval; then the meter's timer reports the stall.
+    """
+    CHUNKSIZE = 4096
+    VECTOR = 16
+
+    def __init__(self, side_in, side_out, callback, *, every=None, interval=None, preview=80,
+                 keepopen=False):
+        self.side_in = side_in
+        self.side_out = side_out
+        claim(side_in)
+        claim(side_out)
+        self.callback = callback
+        self.every = every
+        self.interval = interval
+        self.preview = preview
+        self.keepopen = keepopen
+        self.stats = IOStats()
+        self._lock = threading.Lock()
+        self._start = self._last_time = time.monotonic()
+        self._last_bytes = 0
+        self._next = float('inf') if every is None else every
+        self._due = False  # The timer wants a report
+        self._preview = b''
+        self._done = threading.Event()
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+        if interval is not None:
+            threading.Thread(target=self._timer, daemon=True).start()
+
+    def _thread(self):
+        bufs, views = _pooled_views(self)
+        last = []
+        try:
+            while True:
+                chunks = _traced(self, 'read', _read_chunks, self.side_in, views, self.stats)
+                if not chunks:
+                    break
+                _traced(self, 'write', _write_chunks, self.side_out, chunks, self.stats)
+                last = chunks
+                if self.stats.bytes >= self._next or self._due:
+                    self._take_preview(chunks)
+                    self._report(False)
+                elif len(chunks[-1]) < self.CHUNKSIZE:
+                    # A short read: the writer's caught up, so we may be about
+                    # to wait, and a stall report would want this line
+                    self._take_preview(chunks)
+            self._take_preview(last)
+        finally:
+            self._done.set()
+            _release_views(self, bufs)
+            if not self.keepopen:
+                self.side_out.close()
+        self._report(True)
+
+    def _timer(self):
+        """
+        Thread body: ask for a report each interval, or make one if the data
+        has stalled.
+        """
+        while not self._done.wait(self.interval):
+            if self._due:
+                # Nothing was read since the last tick
+                self._report(False)
+            self._due = True
+
+    def _take_preview(self, chunks):
+        """
+        Keep the end of the last line in the chunks (which are only valid
+        until the next read).
+        """
+        tail = []
+        need = self.preview + 2  # Room for a line ending
+        for chunk in reversed(chunks):
+            if need <= 0:
+                break
+            tail.append(bytes(chunk[-need:]))
+            need -= len(tail[-1])
+        data = b''.join(reversed(tail)).rstrip(b'\r\n')
+        if data:
+            self._preview = data.rsplit(b'\n', 1)[-1][-self.preview:]
+
+    def _report(self, eof):
+        with self._lock:
+            now = time.monotonic()
+            total = self.stats.bytes
+            span = now - self._last_time
+            rate = (total - self._last_bytes) / span if span > 0 else 0.0
+            self._last_time = now
+            self._last_bytes = total
+            if self.every is not None:
+                self._next = total + self.every
+            self._due = False
+            _traced(self, 'callback', self.callback,
+                    ProgressReport(total, rate, now - self._start, self._preview, eof))
+
+
+class FileSink:
+    """
+    Writes output to a file on disk.
+
+    Hand ``side_in`` to a process as its output (eg
+    ``Process(stdout=sink.side_in)``), or give a ``source`` to copy from (eg
+    the ``side_out`` of a :class:`Pipe`). Like a :class:`Pipe`, close
+    ``side_in`` once the process has it.
+
+    With no ``source`` and no ``max_size``, ``side_in`` is the file itself,
+    opened for appending, and the process writes straight to disk.
+
+    Otherwise, a thread copies the data into the file, which is rotated when
+    it reaches ``max_size`` bytes: ``path`` becomes ``path.1``, ``path.1``
+    becomes ``path.2``, and so on, keeping ``backups`` old files. Once the
+    source reaches EOF, the file is closed.
+
+    If ``append`` is false, an existing file is truncated first.
+    """
+    CHUNKSIZE = 65536
+    VECTOR = 16
+
+    def __init__(self, path, *, source=None, max_size=None, backups=1, append=True):
+        self.path = os.fspath(path) if hasattr(os, 'fspath') else path
+        self.max_size = max_size
+        self.backups = backups
+        self.append = append
+        self.stats = IOStats()
+        self.thread = None
+        if source is None and max_size is None:
+            self.side_in = open(self.path, 'ab' if append else 'wb', buffering=0)
+            _track(self.side_in, 'file sink')
+            self.source = None
+            return
+        if source is None:
+            pipe = Pipe()
+            self.side_in = pipe.side_in
+            source = pipe.side_out
+        else:
+            self.side_in = None
+        self.source = source
+        claim(source)
+        self._file = self._open(append)
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+
+    def fileno(self):
+        return self.side_in.fileno()
+
+    def _open(self, append):
+        """
+        Open the file for the copying thread. It's the only writer, so no
+        O_APPEND; just start at the end.
+        """
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if not append:
+            flags |= os.O_TRUNC
+        f = open(os.open(self.path, flags, 0o666), 'wb', buffering=0)
+        self._size = f.seek(0, io.SEEK_END)
+        return f
+
+    def _rotate(self):
+        """
+        Move the full file aside and start a new one.
+        """
+        self._file.close()
+        if self.backups > 0:
+            for n in range(self.backups - 1, 0, -1):
+                src = '{}.{}'.format(self.path, n)
+                if os.path.exists(src):
+                    os.replace(src, '{}.{}'.format(self.path, n + 1))
+            os.replace(self.path, self.path + '.1')
+        self._file = self._open(False)
+
+    def _thread(self):
+        bufs, self._views = _pooled_views(self)
+        try:
+            while True:
+                if self.max_size is not None and self._size >= self.max_size:
+                    _traced(self, 'rotate', self._rotate)
+                limit = None if self.max_size is None else self.max_size - self._size
+                copied = self._copy(limit)
+                if not copied:
+                    break
+                self._size += copied
+        finally:
+            _release_views(self, bufs)
+            self._file.close()
+
+    def _copy(self, limit):
+        """
+        Copy up to limit bytes (or as much as is available, if None) from the
+        source to the file. Returns how much was copied; 0 at EOF.
+        """
+        views = self._views if limit is None else _limit_views(self._views, limit)
+        chunks = _traced(self, 'read', _read_chunks, self.source, views, self.stats)
+        if chunks:
+            _traced(self, 'write', _write_chunks, self._file, chunks, self.stats)
+        return sum(map(len, chunks))
+
+
+class MappedCapture:
+    """
+    Captures output into a memory-mapped temporary file, which can be read at
+    random while it's still being written.
+
+    Hand ``side_in`` to a process as its output, or give a ``source`` to read
+    from. Like a :class:`Pipe`, close ``side_in`` once the process has it.
+
+    The data is read straight into the mapping, and is never held in the
+    Python heap; the kernel pages it in and out as needed. The file is sparse,
+    with ``reserve`` bytes mapped to start with; when that fills up, a mapping
+    twice the size replaces it.
+
+    Lines are indexed as the data arrives.
+    """
+    CHUNKSIZE = 1024 * 1024
+
+    def __init__(self, source=None, *, reserve=64 * 1024 * 1024, dir=None):
+        if source is None:
+            pipe = Pipe()
+            self.side_in = pipe.side_in
+            source = pipe.side_out
+        else:
+            self.side_in = None
+        self.source = source
+        claim(source)
+        self.stats = IOStats()
+        self._file = tempfile.TemporaryFile(dir=dir)
+        self._size = 0  # Committed
+        self._eof = False
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, future, size) of async waiters
+        self._maps = []  # Replaced mappings, kept while views of them exist
+        self._map = self._mapping(max(reserve, mmap.PAGESIZE))
+        self._line_starts = array.array('Q', [0])
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, exc, b):
+        self.close()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def eof(self):
+        """
+        The source has ended, so no more data will arrive.
+        """
+        return self._eof
+
+    def _mapping(self, capacity):
+        """
+        Extend the file (sparsely) and map it.
+        """
+        os.ftruncate(self._file.fileno(), capacity)
+        return mmap.mmap(self._file.fileno(), capacity)
+
+    def _grow(self):
+        """
+        Replace the mapping with one twice the size.
+        """
+        bigger = self._mapping(len(self._map) * 2)
+        self._maps.append(self._map)
+        self._map = bigger
+        # Drop old mappings that nobody has views of
+        for old in self._maps[:]:
+            try:
+                old.close()
+            except BufferError:
+                pass
+            else:
+                self._maps.remove(old)
+
+    def _thread(self):
+        try:
+            while True:
+                if self._size == len(self._map):
+                    with self._cond:
+                        _traced(self, 'grow', self._grow)
+                with memoryview(self._map) as whole:
+                    end = min(len(whole), self._size + self.CHUNKSIZE)
+                    with whole[self._size:end] as view:
+                        chunks = _traced(
+                            self, 'read', _read_chunks, self.source, [view], self.stats)
+                        if not chunks:
+                            break
+                        size = len(chunks[0])
+                        if not isinstance(chunks[0], memoryview):
+                            # The file couldn't read into the mapping
+                            view[:size] = chunks[0]
+                        for chunk in chunks:
+                            if isinstance(chunk, memoryview):
+                                chunk.release()
+                self._index(self._size, self._size + size)
+                self._publish(self._size + size, False)
+        finally:
+            self._publish(self._size, True)
+
+    def _index(self, start, end):
+        """
+        Add the starts of the lines ending in this new data.
+        """
+        find = self._map.find
+        pos = find(b'\n', start, end)
+        while pos != -1:
+            self._line_starts.append(pos + 1)
+            pos = find(b'\n', pos + 1, end)
+
+    def _publish(self, size, eof):
+        with self._cond:
+            self._size = size
+            self._eof = eof
+            self._cond.notify_all()
+            waiting = []
+            for loop, fut, after in self._waiters:
+                if size > after or eof:
+                    loop.call_soon_threadsafe(self._resolve, fut, size)
+                else:
+                    waiting.append((loop, fut, after))
+            self._waiters = waiting
+
+    @staticmethod
+    def _resolve(fut, size):
+        # Runs in the event loop
+        if not fut.done():
+            fut.set_result(size)
+
+    def view(self, start=0, stop=None):
+        """
+        A memoryview of the captured data, from ``start`` to ``stop`` (default:
+        all of it so far). It stays valid after more data arrives, but should be
+        released when done with.
+        """
+        with self._cond:
+            size = self._size
+            stop = size if stop is None else min(stop, size)
+            with memoryview(self._map) as whole:
+                return whole[start:max(start, stop)]
+
+    def wait(self, size=None, timeout=None):
+        """
+        Block until there's more than ``size`` bytes (default: as much as there
+        is now), or the source ends. Returns how much there is, which is the
+        same as before if the wait timed out.
+        """
+        with self._cond:
+            if size is None:
+                size = self._size
+            self._cond.wait_for(lambda: self._size > size or self._eof, timeout)
+            return self._size
+
+    def wait_async(self, size=None):
+        """
+        Like :meth:`wait`, but returns an asyncio future.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        with self._cond:
+            if size is None:
+                size = self._size
+            if self._size > size or self._eof:
+                fut.set_result(self._size)
+            else:
+                self._waiters.append((loop, fut, size))
+        return fut
+
+    @property
+    def line_count(self):
+        """
+        How many lines have been captured. The last line only counts once it's
+        ended, or at EOF.
+        """
+        count = len(self._line_starts) - 1
+        if self._eof and self._line_starts[-1] < self._size:
+            count += 1
+        return count
+
+    def line_offset(self, index):
+        """
+        Where a line starts.
+        """
+        if not 0 <= index < self.line_count:
+            raise IndexError("line index out of range")
+        return self._line_starts[index]
+
+    def line(self, index):
+        """
+        A memoryview of a line, including its line ending.
+        """
+        start = self.line_offset(index)
+        stop = self._line_starts[index + 1] if index + 1 < len(self._line_starts) else None
+        return self.view(start, stop)
+
+    def close(self):
+        """
+        Throw away the captured data. Any views of it must be released first.
+        """
+        self._map.close()
+        for old in self._maps:
+            old.close()
+        self._file.close()
+
+
+TimedChunk = collections.namedtuple('TimedChunk', 'stream time data')
+TimedChunk.__doc__ = """
+One entry of a :class:`TimedCapture`: the index of the stream it came from,
+when it arrived (``time.monotonic()``), and the data (bytes).
+"""
+
+
+class TimedCapture:
+    """
+    Captures several streams together, recording which stream each piece of
+    data came from and when it arrived, so their interleaving can be seen.
+
+    Each source is a readable file, or None to make a :class:`Pipe`; hand
+    ``side_ins[n]`` to a process and close it, as with any pipe.
+
+    Each read is an entry; if ``lines`` is true, each line is instead (a line
+    longer than ``LINE_MAX`` is split), timed by when it was completed.
+
+    The data of all the streams is kept in the one ``data`` buffer, and the
+    entries in arrays: ``streams``, ``times``, ``offsets`` and ``lengths``. So
+    a long capture takes no Python objects per entry; indexing or iterating
+    the capture makes :class:`TimedChunk` as they're needed.
+
+    NOTE: This implementation reads each stream on its own thread.
+    """
+    CHUNKSIZE = 4096
+    VECTOR = 16
+    LINE_MAX = 65536
+
+    def __init__(self, *sources, lines=False):
+        self.side_ins = []
+        self.sources = []
+        for source in sources:
+            if source is None:
+                pipe = Pipe()
+                self.side_ins.append(pipe.side_in)
+                source = pipe.side_out
+            else:
+                self.side_ins.append(None)
+            claim(source)
+            self.sources.append(source)
+        self.lines = lines
+        self.stats = IOStats()
+        self.data = bytearray()
+        self.streams = array.array('B')
+        self.times = array.array('d')
+        self.offsets = array.array('Q')
+        self.lengths = array.array('Q')
+        self._carries = [bytearray() for _ in self.sources]  # For line mode
+        self._lock = threading.Lock()
+        self._start()
+
+    @classmethod
+    def of(cls, proc, *, lines=False):
+        """
+        Capture the standard output (stream 0) and error (stream 1) of a
+        process that hasn't started yet.
+        """
+        if proc.started:
+            raise ValueError("Process has already started")
+        capture = cls(None, None, lines=lines)
+        proc.stdout, proc.stderr = capture.side_ins
+        return capture
+
+    def _start(self):
+        self.thread = threading.Thread(target=_run_connector, args=(self,), daemon=True)
+        self.thread.start()
+
+    def _thread(self):
+        pumps = [threading.Thread(target=self._pump, args=(stream,), daemon=True)
+                 for stream in range(len(self.sources))]
+        for pump in pumps:
+            pump.start()
+        for pump in pumps:
+            pump.join()
+
+    def _pump(self, stream):
+        """
+        Thread body: capture one stream.
+        """
+        bufs, views = _pooled_views(self)
+        try:
+            while True:
+                chunks = _traced(self, 'read', _read_chunks, self.sources[stream], views,
+                                 self.stats)
+                if not chunks:
+                    break
+                with self._lock:
+                    self._record(stream, chunks, time.monotonic())
+        finally:
+            _release_views(self, bufs)
+            with self._lock:
+                self._record_end(stream, time.monotonic())
+
+    def _append(self, stream, now, pieces):
+        """
+        Add an entry made of the pieces.
+        """
+        offset = len(self.data)
+        for piece in pieces:
+            self.data += piece
+        self.streams.append(stream)
+        self.times.append(now)
+        self.offsets.append(offset)
+        # Last, as it's what __len__ goes by
+        self.lengths.append(len(self.data) - offset)
+
+    def _record(self, stream, chunks, now):
+        """
+        Add what was read from a stream, holding back any partial line.
+        """
+        if not self.lines:
+            self._append(stream, now, chunks)
+            return
+        carry = self._carries[stream]
+        data = _joined(chunks, self.stats)
+        start = 0
+        while True:
+            end = data.find(b'\n', start) + 1
+            if not end:
+                if len(carry) + len(data) - start > self.LINE_MAX:
+                    end = start + max(self.LINE_MAX - len(carry), 0)
+                else:
+                    break
+            self._append(stream, now, [carry, memoryview(data)[start:end]])
+            carry.clear()
+            start = end
+        carry += memoryview(data)[start:]
+
+    def _record_end(self, stream, now):
+        carry = self._carries[stream]
+        if carry:
+            self._append(stream, now, [carry])
+            carry.clear()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        with self._lock:
+            offset = self.offsets[index]
+            return TimedChunk(self.streams[index], self.times[index],
+                              bytes(self.data[offset:offset + self.lengths[index]]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def eof(self):
+        """
+        Every stream has ended, so the capture is complete.
+        """
+        return not self.thread.is_alive()
+
+    def stream(self, stream):
+        """
+        All the data captured from one stream.
+        """
+        with self._lock:
+            return b''.join(
+                self.data[offset:offset + length]
+                for s, offset, length in zip(self.streams, self.offsets, self.lengths)
+                if s == stream)
+
+
+def _direct_fd(f):
+    """
+    The file descriptor of a file that a child can read from directly, or
+    None if the file holds data in this process (eg read-ahead buffering).
+    """
+    try:
+        fd = f.fileno()
+    except (AttributeError, io.UnsupportedOperation, ValueError):
+        return None
+    if isinstance(f, io.FileIO):
+        return fd
+    try:
+        # Nothing buffered if our position is the same as the descriptor's
+        return fd if f.tell() == os.lseek(fd, 0, io.SEEK_CUR) else None
+    except OSError:
+        # Not seekable, so can't tell
+        return None
+
+
+class Source:
+    """
+    Data for a process's standard input (or anything else reading a pipe),
+    written as the reader takes it, so it needn't all be in memory at once.
+
+    ``data`` may be:
+
+    * bytes-like: written in as few calls as possible
+    * a file: handed over as it is if it has a file descriptor the reader can
+      use directly; otherwise read ``BATCH`` bytes at a time
+    * an iterable of bytes-likes
+    * an async iterable of bytes-likes, run on ``loop`` (default: the current
+      event loop)
+
+    Pass the Source itself as ``stdin``. When the data ends, the pipe is
+    closed, so the reader sees EOF. This process's copy of the reading end is
+    closed once it's handed to a process.
+
+    NOTE: This implementation writes each Source from its own thread.
+    """
+    BATCH = 65536
+
+    def __init__(self, data, *, loop=None):
+        self.data = data
+        self.stats = IOStats()
+        if _direct_fd(data) is not None:
+            self.side_out = data
+            self.side_in = None
+            return
+        if hasattr(data, '__aiter__') and loop is None:
+            import asyncio
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        pipe = Pipe()
+        self.side_out = pipe.side_out
+        self.side_in = pipe.side_in
+        claim(self.side_in)
+        _track(self, 'stdin source')
+        self._start()
+
+    def fileno(self):
+        return self.side_out.fileno()
+
+    @property
+    def closed(self):
+        return self.side_out.closed
+
+    def close(self):
+        """
+        Close this process's copy of the reading end. (A file given as the data
+        is left alone.)
+        """
+        if self.side_in is not None:
+            self.side_out.close()
+
+    def _batches(self):
+        """
+        The data, in batches to write.
+        """
+        data = self.data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            yield data
+        elif hasattr(data, 'read'):
+            yield from iter(functools.partial(data.read, self.BATCH), b'')
+        elif hasattr(data, '__aiter__'):
+            it = data.__aiter__()
+            while True:
+                try:
+                    yield self._anext(it).result()
+                except StopAsyncIteration:
+                    return
+        else:
+            # Gather small items into bigger writes
+            batch = []
+            size = 0
+            for item in data:
+                batch.append(item)
+                size += len(item)
+                if size >= self.BATCH:
+                    yield _joined(batch, self.stats)
+                    batch = []
+                    size = 0
+            if batch:
+                yield _joined(batch, self.stats)
+
+    def _anext(self, it):
+        """
+        Get the next item of an async iterator from another thread, as a
+        concurrent.futures.Future.
+        """
+        import asyncio
+        import concurrent.futures
+        result = concurrent.futures.Future()
+
+        def _done(fut):
+            if fut.cancelled():
+                result.cancel()
+            elif fut.exception() is not None:
+                result.set_exception(fut.exception())
+            else:
+                result.set_result(fut.result())
+
+        def _start():
+            asyncio.ensure_future(it.__anext__(), loop=self.loop).add_done_callback(_done)
+
+        self.loop.call_soon_threadsafe(_start)
+        return result
+
+    def _start(self):
+        threading.Thread(target=_run_connector, args=(self,), daemon=True).start()
+
+    def _thread(self):
+        try:
+            for batch in self._batches():
+                if batch:
+                    self.stats.bytes += len(batch)
+                    _traced(self, 'write', _write_chunks, self.side_in, [batch], self.stats)
+        except BrokenPipeError:
+            # The reader has gone away
+            pass
+        finally:
+            self.side_in.close()
+
+# }}}
+
+
+##################
+# {{{ Events
+##################
+
+SPAWNED = "spawned"
+EXITED = "exited"
+STOPPED = "stopped"
+CONTINUED = "continued"
+CONNECTOR_EOF = "connector-eof"
+CONNECTOR_ERROR = "connector-error"
+
+
+def _state_event(old, new):
+    """
+    The kind of event for a change of status.
+    """
+    if new == FINISHED:
+        return EXITED
+    elif new == PAUSED:
+        return STOPPED
+    elif old == PAUSED:
+        return CONTINUED
+    else:
+        return SPAWNED
+
+
+Event = collections.namedtuple('Event', 'kind time source pid pgid data')
+Event.__doc__ = """
+Something that happened to a process, process group, or connector.
+
+* ``kind``: One of SPAWNED, EXITED, STOPPED, CONTINUED, CONNECTOR_EOF, CONNECTOR_ERROR
+* ``time``: When it happened, by ``time.monotonic()``
+* ``source``: The object it happened to
+* ``pid``: The process ID, or None for groups and connectors
+* ``pgid``: The process group ID, if known
+* ``data``: A dict of extras: ``return_code`` and ``signal`` for process
+  exits, ``error`` for connector errors
+"""
+
+
+class EventStream:
+    """
+    Publishes events to subscribers.
+
+    Subscribers are either callbacks, which are called with each ``Event``, or
+    an ``EventQueue``, from ``queue()``.
+
+    NOTE: Like ``Tee`` callbacks, subscribers are called from whatever thread
+    the event happened on, possibly with locks held. They should hand the event
+    off quickly.
+
+    Nothing is done (not even making the event) while there are no subscribers.
+    """
+    def __init__(self):
+        # Replaced rather than changed, so emit() can use it without a lock
+        self._subscribers = ()
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, callback):
+        """
+        Call the callable with every event from now on. Returns the callable.
+        """
+        with self._lock:
+            self._subscribers += (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling a subscribed callable.
+        """
+        with self._lock:
+            subs = list(self._subscribers)
+            subs.remove(callback)
+            self._subscribers = tuple(subs)
+
+    def queue(self):
+        """
+        Subscribe a new ``EventQueue`` and return it.
+        """
+        q = EventQueue(self)
+        self.subscribe(q._put)
+        return q
+
+    def emit(self, kind, source, pid=None, pgid=None, **data):
+        """
+        Publish an event to all the subscribers.
+        """
+        subs = self._subscribers
+        if subs:
+            event = Event(kind, time.monotonic(), source, pid, pgid, data)
+            for sub in subs:
+                sub(event)
+
+
+class EventQueue:
+    """
+    A subscription to an ``EventStream`` that buffers events until they're read.
+
+    Read it with ``get()``, by iterating over it, or by iterating over it
+    asynchronously (``async for``). Iteration ends when the queue is closed.
+    """
+    _CLOSED = object()
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._queue = queue.Queue()
+        self._waiters = collections.deque()  # (loop, future) of async readers
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, exc, b):
+        self.close()
+
+    def close(self):
+        """
+        Unsubscribe. Readers get what's left, and then iteration ends.
+        """
+        if not self.closed:
+            self.closed = True
+            self._stream.unsubscribe(self._put)
+            self._put(self._CLOSED)
+
+    def _put(self, event):
+        with self._lock:
+            while self._waiters:
+                loop, fut = self._waiters.popleft()
+                if not fut.done():
+                    loop.call_soon_threadsafe(self._resolve, fut, event)
+                    if event is not self._CLOSED:
+                        return
+            self._queue.put(event)
+
+    def _resolve(self, fut, event):
+        # Runs in the event loop
+        if fut.done():
+            # Cancelled in the meantime, so keep it for the next reader
+            self._put(event)
+        elif event is self._CLOSED:
+            fut.set_exception(StopAsyncIteration())
+        else:
+            fut.set_result(event)
+
+    def get(self, timeout=None):
+        """
+        Get the next event, waiting for one if necessary.
+
+        Raises ``queue.Empty`` on timeout, or if the queue is closed and empty.
+        """
+        event = self._queue.get(timeout=timeout)
+        if event is self._CLOSED:
+            # Leave it for any other readers
+            self._queue.put(event)
+            raise queue.Empty
+        return event
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except queue.Empty:
+                return
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        with self._lock:
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                self._waiters.append((loop, fut))
+            else:
+                if event is self._CLOSED:
+                    self._queue.put(event)
+                    fut.set_exception(StopAsyncIteration())
+                else:
+                    fut.set_result(event)
+        return fut
+
+
+events = EventStream()
+
+# }}}
+
+
+##################
+# {{{ Tracing
+##################
+
+# The active Tracer, if any
+_tracer = None
+
+
+def _traced(connector, name, func, *args):
+    """
+    Call a function, recording how long it took if tracing.
+
+    Used by plumbing for each step of its loop, so the trace shows when it was
+    blocked on reading versus writing.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        tracer._spans.append((connector, name, start, time.perf_counter(), None))
+
+
+class Tracer:
+    """
+    Records a timeline of processes and plumbing, for the Chrome/Perfetto
+    trace viewers (``chrome://tracing``, https://ui.perfetto.dev).
+
+    While a tracer is running, it records:
+
+    * For each process: when it was running, when it was paused, and its exit
+    * For each ``Tee``, ``Valve``, and ``QuickConnect``: time spent blocked on
+      reading, writing, its callback, or its gate
+
+    Spans are kept in memory, up to ``limit`` of them (the oldest are dropped).
+    Only one tracer runs at a time.
+    """
+    def __init__(self, limit=1000000):
+        self._spans = collections.deque(maxlen=limit)
+        self._open = {}  # process: (span name, start)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, t, exc, b):
+        self.stop()
+
+    def start(self):
+        """
+        Start recording.
+        """
+        global _tracer
+        if _tracer is not None:
+            raise RuntimeError("A tracer is already running")
+        _tracer = self
+        events.subscribe(self._on_event)
+
+    def stop(self):
+        """
+        Stop recording. Spans still open are ended now.
+        """
+        global _tracer
+        if _tracer is self:
+            _tracer = None
+            events.unsubscribe(self._on_event)
+        now = time.perf_counter()
+        for proc, (name, start) in list(self._open.items()):
+            self._spans.append((proc, name, start, now, None))
+        self._open.clear()
+
+    def _on_event(self, event):
+        if not isinstance(event.source, Process):
+            return
+        # Events are timed by the monotonic clock, which is too coarse on
+        # some platforms. They're delivered immediately, so just use now.
+        now = time.perf_counter()
+        proc = event.source
+        if proc in self._open:
+            name, start = self._open.pop(proc)
+            self._spans.append((proc, name, start, now, None))
+        if event.kind in (SPAWNED, CONTINUED):
+            self._open[proc] = 'running', now
+        elif event.kind == STOPPED:
+            self._open[proc] = 'paused', now
+        elif event.kind == EXITED:
+            self._spans.append((proc, 'exit', now, None, event.data))
+
+    def to_json(self):
+        """
+        The trace, as a JSON-able dict in the Chrome trace event format.
+        """
+        # Processes are one trace "process", plumbing is another, and each
+        # child process or connector is a "thread" in one of those.
+        host = os.getpid()
+        trace = [
+            {'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'processes'}},
+            {'name': 'process_name', 'ph': 'M', 'pid': 2,
+             'args': {'name': 'plumbing (pid {})'.format(host)}},
+        ]
+        tracks = {}
+        connectors = 0
+        for source, name, start, end, args in list(self._spans):
+            if source not in tracks:
+                if isinstance(source, Process):
+                    track = 1, source.pid
+                    cmd = source.cmd
+                    label = ' '.join(cmd) if isinstance(cmd, (list, tuple)) else str(cmd)
+                else:
+                    connectors += 1
+                    track = 2, connectors
+                    label = '{} {}'.format(type(source).__name__, track[1])
+                tracks[source] = track
+                trace.append({'name': 'thread_name', 'ph': 'M', 'pid': track[0],
+                              'tid': track[1], 'args': {'name': label}})
+            pid, tid = tracks[source]
+            if end is None:
+                trace.append({'name': name, 'ph': 'i', 's': 't', 'pid': pid, 'tid': tid,
+                              'ts': start * 1e6, 'args': args or {}})
+            else:
+                trace.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                              'ts': start * 1e6, 'dur': (end - start) * 1e6})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, fp):
+        """
+        Write the trace as JSON to a text file, to load in a trace viewer.
+        """
+        json.dump(self.to_json(), fp)
+
 # }}}
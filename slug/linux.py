@@ -0,0 +1,568 @@
+"""
+Versions of the functionality using Linux-specific interfaces.
+"""
+import collections
+import ctypes
+import errno
+import fcntl
+import glob
+import os
+import select
+import selectors
+import signal
+import threading
+import time
+import weakref
+from . import base, posix
+
+__all__ = (
+    'Process', 'ProcessGroup', 'Subreaper', 'ResourceSampler', 'ResourceSample',
+    'ResourceSnapshot', 'FileSink',
+)
+
+PR_SET_CHILD_SUBREAPER = 36
+SYS_close_range = 436
+CLOSE_RANGE_CLOEXEC = 1 << 2
+
+# Loaded on first use
+_libc_handle = None
+
+# The running Subreaper, if any
+_subreaper = None
+
+# Every ProcessGroup, so orphans can be matched up with them
+_groups = weakref.WeakSet()
+
+
+class Process(posix.Process):
+    # For pipes that capture() reads
+    PIPE_SIZE = 1024 * 1024
+
+    def _fd_table_step(self):
+        # Load it now, rather than in the child
+        _libc()
+        return super()._fd_table_step()
+
+    @staticmethod
+    def _cloexec_except(keep):
+        # close_range() marks whole ranges at once, no matter how many
+        # descriptors are open
+        syscall = _libc().syscall
+        first = 3
+        for fd in list(keep) + [None]:
+            last = 0xFFFFFFFF if fd is None else fd - 1
+            if first <= last and syscall(SYS_close_range, ctypes.c_uint(first),
+                                         ctypes.c_uint(last), CLOSE_RANGE_CLOEXEC) != 0:
+                # Kernel before 5.11
+                return posix.Process._cloexec_except(keep)
+            first = last + 2
+
+    def _tune_pipe(self, fd):
+        # A bigger pipe means fewer reads (and fewer context switches) per MB
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, self.PIPE_SIZE)
+        except (OSError, AttributeError):
+            # Over /proc/sys/fs/pipe-max-size, or an old Python
+            pass
+
+    def _wait_exit(self, timeout):
+        if timeout is None or not hasattr(os, 'pidfd_open') or self._proc.returncode is not None:
+            return super()._wait_exit(timeout)
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except ProcessLookupError:
+            # Already reaped
+            return super()._wait_exit(timeout)
+        try:
+            # Readable once the process exits; no polling
+            ready, _, _ = select.select([pidfd], [], [], timeout)
+        finally:
+            os.close(pidfd)
+        return bool(ready) and super()._wait_exit(None)
+
+
+class ProcessGroup(posix.ProcessGroup):
+    """
+    A collection of processes that can be controlled as a group.
+
+    The process group is inherited. The descendent processes are also part of
+    the group.
+
+    While a :class:`Subreaper` is running, descendants that are orphaned (eg by
+    daemonizing) are adopted and tracked in ``orphans`` (a set of PIDs), and
+    signals, ``kill()`` and ``join()`` cover them too, even if they've left
+    the process group.
+    """
+    _process_type = Process
+    _sid = None
+
+    def __init__(self):
+        super().__init__()
+        self.orphans = set()
+        _groups.add(self)
+
+    def _signal_orphans(self, sig):
+        reaper = _subreaper
+        if reaper is None:
+            return
+        reaper.scan()
+        for pid in list(self.orphans):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def signal(self, sig):
+        super().signal(sig)
+        self._signal_orphans(sig)
+
+    def kill(self):
+        super().kill()
+        self._signal_orphans(signal.SIGKILL)
+
+    def terminate(self):
+        super().terminate()
+        self._signal_orphans(signal.SIGTERM)
+
+    def join(self, timeout=None):
+        """
+        Wait for all the processes to finish, for at most ``timeout`` seconds
+        in total if given. Check ``status`` to see if they did.
+
+        With a :class:`Subreaper` running, this also waits for the orphans.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        super().join(timeout)
+        reaper = _subreaper
+        if reaper is not None:
+            reaper.scan()
+            reaper.wait(self, None if deadline is None else max(0, deadline - time.monotonic()))
+
+
+def _libc():
+    global _libc_handle
+    if _libc_handle is None:
+        _libc_handle = ctypes.CDLL(None, use_errno=True)
+    return _libc_handle
+
+
+def _libc_prctl(option, value):
+    libc = _libc()
+    if libc.prctl(option, ctypes.c_ulong(value), 0, 0, 0) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _proc_stat(pid):
+    """
+    Read a process's parent, process group, and session from /proc.
+    """
+    with open('/proc/{}/stat'.format(pid), 'rb') as f:
+        data = f.read()
+    # The command name may contain anything, including spaces and parens
+    fields = data[data.rindex(b')') + 2:].split()
+    return int(fields[1]), int(fields[2]), int(fields[3])
+
+
+class Subreaper:
+    """
+    Makes this process the reaper of orphaned descendants
+    (``PR_SET_CHILD_SUBREAPER``), so that they're reparented here rather than to
+    init.
+
+    Each orphan is attributed to the :class:`ProcessGroup` it came from, by
+    process group ID, or by session ID if the group is a session of its own;
+    it's added to the group's ``orphans`` and reaped when it exits, so zombies
+    don't pile up. Children that can't be attributed to a group are left
+    alone, since they may belong to other code.
+
+    New orphans are looked for every ``interval`` seconds, and whenever a group
+    is signalled or joined.
+    """
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.reaped = 0  # Orphans reaped so far
+        self._orphans = {}  # pid: (group, pidfd)
+        self._cond = threading.Condition()
+        self._sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        self._sel.register(self._wake_r, selectors.EVENT_READ)
+        self._running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, t, exc, b):
+        self.stop()
+
+    def start(self):
+        """
+        Become the subreaper and start adopting orphans.
+        """
+        global _subreaper
+        if _subreaper is not None:
+            raise RuntimeError("A subreaper is already running")
+        _libc_prctl(PR_SET_CHILD_SUBREAPER, 1)
+        _subreaper = self
+        self._running = True
+        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop being the subreaper. Orphans already adopted are still ours; they're
+        no longer tracked.
+        """
+        global _subreaper
+        _libc_prctl(PR_SET_CHILD_SUBREAPER, 0)
+        if _subreaper is self:
+            _subreaper = None
+        self._running = False
+        os.write(self._wake_w, b'\0')
+        self.thread.join()
+
+    def _children(self):
+        """
+        The PIDs of this process's children.
+        """
+        paths = glob.glob('/proc/self/task/*/children')
+        if paths:
+            pids = set()
+            for path in paths:
+                try:
+                    with open(path, 'rb') as f:
+                        pids.update(map(int, f.read().split()))
+                except FileNotFoundError:
+                    # The thread exited
+                    pass
+            return pids
+        # Kernel built without the children files; look through everything
+        mypid = os.getpid()
+        pids = set()
+        for path in glob.glob('/proc/[0-9]*'):
+            pid = int(path[6:])
+            try:
+                if _proc_stat(pid)[0] == mypid:
+                    pids.add(pid)
+            except (FileNotFoundError, ProcessLookupError):
+                pass
+        return pids
+
+    def _attribute(self, pid):
+        """
+        Find the group an orphan came from, or None.
+        """
+        try:
+            _, pgid, sid = _proc_stat(pid)
+        except FileNotFoundError:
+            return None
+        ours = os.getsid(0)
+        for group in list(_groups):
+            if group.by_pid(pid) is not None:
+                # A member, not an orphan
+                return None
+            if group.pgid is not None and group._sid is None:
+                try:
+                    group._sid = os.getsid(group.pgid)
+                except ProcessLookupError:
+                    pass
+        for group in list(_groups):
+            if group.pgid == pgid:
+                return group
+        for group in list(_groups):
+            if group._sid is not None and group._sid != ours and group._sid == sid:
+                return group
+        return None
+
+    def scan(self):
+        """
+        Look for new orphans.
+        """
+        with self._cond:
+            for pid in self._children() - set(self._orphans):
+                group = self._attribute(pid)
+                if group is None:
+                    continue
+                pidfd = None
+                if hasattr(os, 'pidfd_open'):
+                    try:
+                        pidfd = os.pidfd_open(pid)
+                    except ProcessLookupError:
+                        continue
+                    self._sel.register(pidfd, selectors.EVENT_READ, pid)
+                self._orphans[pid] = group, pidfd
+                group.orphans.add(pid)
+            if not hasattr(os, 'pidfd_open'):
+                for pid in list(self._orphans):
+                    self._reap(pid)
+
+    def _reap(self, pid):
+        """
+        Reap an orphan, if it has exited. Must hold the lock.
+        """
+        try:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            # Someone else reaped it (eg a JobTable)
+            done = pid
+        if not done:
+            return
+        group, pidfd = self._orphans.pop(pid)
+        group.orphans.discard(pid)
+        if pidfd is not None:
+            self._sel.unregister(pidfd)
+            os.close(pidfd)
+        self.reaped += 1
+        self._cond.notify_all()
+
+    def wait(self, group, timeout=None):
+        """
+        Wait for all of a group's orphans to be reaped, for at most ``timeout``
+        seconds if given. Returns True if they were.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not group.orphans, timeout)
+
+    def _thread(self):
+        while self._running:
+            for key, _ in self._sel.select(self.interval):
+                if key.fileobj == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                else:
+                    with self._cond:
+                        if key.data in self._orphans:
+                            self._reap(key.data)
+            if self._running:
+                self.scan()
+
+
+ResourceSample = collections.namedtuple(
+    'ResourceSample', 'pid cpu rss read write read_rate write_rate')
+ResourceSample.__doc__ = """
+Resource usage of one process.
+
+* ``pid``: The process
+* ``cpu``: CPU use since the last sample, in percent of one CPU
+* ``rss``: Resident memory, in bytes
+* ``read``, ``write``: Total bytes read and written (including pipes), or
+  None if they can't be seen
+* ``read_rate``, ``write_rate``: Bytes per second since the last sample
+
+The rates (and ``cpu``) are None in a process's first sample.
+"""
+
+ResourceSnapshot = collections.namedtuple('ResourceSnapshot', 'time samples')
+ResourceSnapshot.__doc__ = """
+One pass of a ResourceSampler: the monotonic ``time`` it was taken, and
+``samples``, a dict mapping PIDs to ResourceSample.
+"""
+
+
+class ResourceSampler:
+    """
+    Samples the resource usage of the members of a process group (and their
+    descendants, if ``descendants``) from ``/proc`` every ``interval`` seconds.
+
+    Each pass produces a ResourceSnapshot, kept as ``latest`` and passed to
+    ``callback`` if given.
+
+    The ``/proc`` files of each process are kept open and re-read in place, so
+    a pass costs a few system calls per process.
+    """
+    _TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGESIZE = os.sysconf('SC_PAGESIZE')
+
+    def __init__(self, group, interval=1.0, *, descendants=False, callback=None):
+        self.group = group
+        self.interval = interval
+        self.descendants = descendants
+        self.callback = callback
+        self.latest = None
+        self._files = {}  # pid: [stat fd, statm fd, io fd or None]
+        self._last = {}  # pid: (time, cpu ticks, read, write)
+        self._stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, t, exc, b):
+        self.stop()
+
+    def start(self):
+        """
+        Start sampling in the background.
+        """
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop sampling, and close the files.
+        """
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        for pid in list(self._files):
+            self._forget(pid)
+
+    def _thread(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def _pids(self):
+        """
+        The processes to sample.
+        """
+        pids = [
+            proc.pid for proc in self.group
+            if isinstance(proc, base.Process) and proc.pid is not None
+            and proc.status != base.FINISHED
+        ]
+        if self.descendants:
+            pending = list(pids)
+            while pending:
+                pid = pending.pop()
+                for path in glob.glob('/proc/{}/task/*/children'.format(pid)):
+                    try:
+                        with open(path, 'rb') as f:
+                            children = list(map(int, f.read().split()))
+                    except (FileNotFoundError, ProcessLookupError):
+                        continue
+                    pids.extend(children)
+                    pending.extend(children)
+        return pids
+
+    def _open(self, pid):
+        files = []
+        try:
+            for name in ('stat', 'statm', 'io'):
+                path = '/proc/{}/{}'.format(pid, name)
+                try:
+                    files.append(os.open(path, os.O_RDONLY | os.O_CLOEXEC))
+                except PermissionError:
+                    if name != 'io':
+                        raise
+                    files.append(None)
+        except OSError:
+            for fd in files:
+                if fd is not None:
+                    os.close(fd)
+            return None
+        self._files[pid] = files
+        return files
+
+    def _forget(self, pid):
+        for fd in self._files.pop(pid, ()):
+            if fd is not None:
+                os.close(fd)
+        self._last.pop(pid, None)
+
+    def _read(self, pid, files):
+        """
+        Re-read a process's files: (cpu ticks, rss, read, write).
+        """
+        stat_fd, statm_fd, io_fd = files
+        stat = os.pread(stat_fd, 4096, 0)
+        statm = os.pread(statm_fd, 4096, 0)
+        if not stat or not statm:
+            # Gone
+            raise ProcessLookupError(pid)
+        fields = stat[stat.rindex(b')') + 2:].split()
+        # utime and stime, fields 14 and 15 of stat(5)
+        ticks = int(fields[11]) + int(fields[12])
+        rss = int(statm.split()[1]) * self._PAGESIZE
+        read = write = None
+        if io_fd is not None:
+            for line in os.pread(io_fd, 4096, 0).splitlines():
+                if line.startswith(b'rchar:'):
+                    read = int(line[6:])
+                elif line.startswith(b'wchar:'):
+                    write = int(line[6:])
+        return ticks, rss, read, write
+
+    def sample(self):
+        """
+        Take a snapshot now, and return it.
+        """
+        now = time.monotonic()
+        samples = {}
+        pids = set(self._pids())
+        for pid in list(self._files):
+            if pid not in pids:
+                self._forget(pid)
+        for pid in pids:
+            files = self._files.get(pid) or self._open(pid)
+            if files is None:
+                continue
+            try:
+                ticks, rss, read, write = self._read(pid, files)
+            except (ProcessLookupError, ValueError, IndexError):
+                # Exited (the files of a dead process stay dead, even if the
+                # PID is reused)
+                self._forget(pid)
+                continue
+            cpu = read_rate = write_rate = None
+            last = self._last.get(pid)
+            if last is not None and now > last[0]:
+                elapsed = now - last[0]
+                cpu = (ticks - last[1]) / self._TICKS / elapsed * 100
+                if read is not None:
+                    read_rate = (read - last[2]) / elapsed
+                    write_rate = (write - last[3]) / elapsed
+            self._last[pid] = now, ticks, read, write
+            samples[pid] = ResourceSample(pid, cpu, rss, read, write, read_rate, write_rate)
+        self.latest = ResourceSnapshot(now, samples)
+        if self.callback is not None:
+            self.callback(self.latest)
+        return self.latest
+
+
+class FileSink(base.FileSink):
+    """
+    Writes output to a file on disk.
+
+    Hand ``side_in`` to a process as its output (eg
+    ``Process(stdout=sink.side_in)``), or give a ``source`` to copy from (eg
+    the ``side_out`` of a :class:`Pipe`). Like a :class:`Pipe`, close
+    ``side_in`` once the process has it.
+
+    With no ``source`` and no ``max_size``, ``side_in`` is the file itself,
+    opened for appending, and the process writes straight to disk.
+
+    Otherwise, the data is moved into the file with ``splice()``, so it never
+    passes through this process (unless the source isn't a pipe). The file is
+    rotated when it reaches ``max_size`` bytes: ``path`` becomes ``path.1``,
+    ``path.1`` becomes ``path.2``, and so on, keeping ``backups`` old files.
+    Once the source reaches EOF, the file is closed.
+
+    If ``append`` is false, an existing file is truncated first.
+    """
+    SPLICE_SIZE = 1 << 20
+
+    def __init__(self, *pargs, **kwargs):
+        self._splice = hasattr(os, 'splice')
+        super().__init__(*pargs, **kwargs)
+
+    def _copy(self, limit):
+        if self._splice:
+            size = self.SPLICE_SIZE if limit is None else min(limit, self.SPLICE_SIZE)
+            try:
+                copied = base._traced(self, 'splice', os.splice,
+                                      self.source.fileno(), self._file.fileno(), size)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                # Not a pipe; copy the ordinary way
+                self._splice = False
+            else:
+                self.stats.reads += 1
+                self.stats.writes += 1
+                self.stats.bytes += copied
+                return copied
+        return super()._copy(limit)
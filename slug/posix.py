@@ -3,14 +3,20 @@ Versions of the base functionality optimized for by-the-spec POSIX.
 
 Linux/Mac/BSD-specific code should live elsewhere.
 """
+import collections
+import fcntl
 import signal
 import selectors
 import threading
 import os
 import subprocess
+import time
 from . import base
 
-__all__ = ('Process', 'ProcessGroup', 'Valve', 'QuickConnect')
+__all__ = (
+    'Process', 'ProcessGroup', 'JobTable', 'Valve', 'QuickConnect', 'Multiplexer', 'Source',
+    'TimedCapture',
+)
 
 
 class Process(base.Process):
@@ -18,32 +24,84 @@ class Process(base.Process):
         """
         Start the process.
         """
-        preexec = None
+        steps = []
         if hasattr(self, '_process_group_leader'):
             # This probably needs some kind of syncronization...
             if self._process_group_leader is ...:
-                preexec = os.setpgrp
+                steps.append(os.setpgrp)
             else:
                 pgid = self._process_group_leader.pid
+                steps.append(lambda: os.setpgid(0, pgid))
+        if self.fds:
+            steps.append(self._fd_table_step())
 
-                def preexec():
-                    os.setpgid(0, pgid)
+        def preexec():
+            for step in steps:
+                step()
 
         self._proc = subprocess.Popen(
             # What to execute
             self.cmd,
-            preexec_fn=preexec,
+            preexec_fn=preexec if steps else None,
             # What IO it has
             stdin=self.stdin, stdout=self.stdout, stderr=self.stderr,
+            # Popen would close our descriptors after preexec; we do it instead
+            close_fds=not self.fds,
             # Environment it executes in
             cwd=self.cwd, env=self.environ,
         )
+        self._hand_over()
+        self._set_state(base.RUNNING)
+
+    def _fd_table_step(self):
+        """
+        Make the preexec step that arranges the child's file descriptors.
+        """
+        mapping = {
+            target: source if isinstance(source, int) else source.fileno()
+            for target, source in self.fds.items()
+        }
+        keep = sorted(mapping)
+        # Above every descriptor involved, so nothing is clobbered while
+        # shuffling, eg when swapping 3 and 4
+        spare = max(keep + list(mapping.values())) + 1
+
+        def step():
+            moved = {
+                target: fcntl.fcntl(source, fcntl.F_DUPFD_CLOEXEC, spare)
+                for target, source in mapping.items()
+            }
+            for target, fd in moved.items():
+                # dup2() clears close-on-exec on the new descriptor
+                os.dup2(fd, target)
+            # Close everything else at exec. (Not now: subprocess still needs
+            # its own close-on-exec descriptors.)
+            self._cloexec_except(keep)
+
+        return step
+
+    @staticmethod
+    def _cloexec_except(keep):
+        """
+        In the child: mark every descriptor from 3 up, except those in keep, as
+        close-on-exec.
+        """
+        for name in os.listdir('/dev/fd'):
+            fd = int(name)
+            if fd >= 3 and fd not in keep:
+                try:
+                    os.set_inheritable(fd, False)
+                except OSError:
+                    # The descriptor listdir() was using
+                    pass
 
     def pause(self):
         """
         Pause the process, able to be continued later
         """
         self.signal(signal.SIGSTOP)
+        if self._state == base.RUNNING:
+            self._set_state(base.PAUSED)
 
     def unpause(self):
         # continue is a reserved word
@@ -51,6 +109,124 @@ class Process(base.Process):
         Continue the process after it's been paused
         """
         self.signal(signal.SIGCONT)
+        if self._state == base.PAUSED:
+            self._set_state(base.RUNNING)
+
+    def join(self, timeout=None):
+        """
+        Wait for the process to finish, for at most ``timeout`` seconds if
+        given. Check ``status`` to see if it did.
+        """
+        group = getattr(self, '_process_group', lambda: None)()
+        table = group._job_table if group is not None else None
+        if table is not None and table._reaps(self):
+            # The job table reaps it, and tells us when it's done
+            self._finished.wait(timeout)
+        else:
+            super().join(timeout)
+
+    def _drain(self, sources, feed, input, limit, deadline):
+        """
+        Feed input and collect output for capture(), with one selector loop in
+        this thread.
+
+        Output is read straight into a buffer for each stream, which grows by
+        doubling, so there's one system call per pipe-full.
+        """
+        sel = selectors.DefaultSelector()
+        buffers = {}  # fd: [name, buffer, size]
+        for name, f in sources.items():
+            fd = f.fileno()
+            os.set_blocking(fd, False)
+            self._tune_pipe(fd)
+            buffers[fd] = [name, bytearray(65536 if limit is None else min(65536, limit)), 0]
+            sel.register(fd, selectors.EVENT_READ)
+        pending = None
+        feed_fd = None
+        if feed is not None:
+            pending = memoryview(input)
+            feed_fd = feed.fileno()
+            os.set_blocking(feed_fd, False)
+            if pending:
+                sel.register(feed_fd, selectors.EVENT_WRITE)
+            else:
+                feed.close()
+        truncated = []
+        scratch = None  # Somewhere to read what's over the limit
+        timed_out = False
+
+        try:
+            while sel.get_map():
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        timed_out = True
+                        break
+                for key, _ in sel.select(timeout):
+                    fd = key.fd
+                    if fd == feed_fd:
+                        try:
+                            pending = pending[os.write(fd, pending):]
+                        except BlockingIOError:
+                            continue
+                        except BrokenPipeError:
+                            pending = pending[:0]
+                        if not pending:
+                            sel.unregister(fd)
+                            feed.close()
+                        continue
+
+                    entry = buffers[fd]
+                    name, buf, size = entry
+                    if size == len(buf) and (limit is None or size < limit):
+                        buf.extend(bytes(len(buf) if limit is None
+                                         else min(len(buf), limit - size)))
+                    try:
+                        if size < len(buf):
+                            with memoryview(buf)[size:] as view:
+                                count = os.readv(fd, [view])
+                            entry[2] = size + count
+                        else:
+                            if scratch is None:
+                                scratch = bytearray(65536)
+                            count = os.readv(fd, [scratch])
+                            if count and name not in truncated:
+                                truncated.append(name)
+                    except BlockingIOError:
+                        continue
+                    if not count:
+                        sel.unregister(fd)
+        finally:
+            sel.close()
+            if pending is not None:
+                pending.release()
+
+        output = {}
+        for name, buf, size in buffers.values():
+            with memoryview(buf)[:size] as view:
+                output[name] = view.tobytes()
+        return output, tuple(truncated), timed_out
+
+    def _tune_pipe(self, fd):
+        """
+        Adjust a pipe that capture() reads from.
+        """
+
+    def _pgid_hint(self):
+        leader = getattr(self, '_process_group_leader', None)
+        if self.pid is None:
+            return None
+        elif leader is ...:
+            return self.pid
+        elif leader is not None:
+            return leader.pid
+        else:
+            return os.getpgrp()
+
+    def _exit_signal(self):
+        if self.return_code is not None and self.return_code < 0:
+            return -self.return_code
 
     @property
     def pgid(self):
@@ -74,6 +250,9 @@ class Process(base.Process):
 
 class ProcessGroup(base.ProcessGroup):
     pgid = None
+    _leader = None
+    _job_table = None
+    _process_type = Process
 
     def add(self, proc):
         super().add(proc)
@@ -94,6 +273,54 @@ class ProcessGroup(base.ProcessGroup):
             # Don't use pgid here because sometimes programs exit in their first
             # slice (eg on Mac, see https://github.com/xonsh/slug/issues/10)
             self.pgid = leader.pid
+            self._leader = leader
+
+    @property
+    def started(self):
+        return self.pgid is not None
+
+    def _member_changed(self, proc, old, new):
+        super()._member_changed(proc, old, new)
+        if self._job_table is not None:
+            if old == base.INIT:
+                self._job_table._member_started(self, proc)
+            self._job_table._member_changed(self, proc, new)
+
+    def _has_live_members(self):
+        """
+        Does the process group still exist in the kernel?
+
+        Members are only counted as finished once they've been reaped, so this
+        includes zombies, which hold on to their process group.
+        """
+        return bool(self._counts[base.RUNNING] or self._counts[base.PAUSED])
+
+    def _start_member(self, proc):
+        if isinstance(proc, base.VirtualProcess):
+            proc.start()
+        elif self._leader is not None and self._has_live_members():
+            proc._process_group_leader = self._leader
+            proc.start()
+        else:
+            # Either nothing has started, or everything has been reaped and
+            # the old process group is gone. Either way, start a new one.
+            proc._process_group_leader = ...
+            proc.start()
+            self.pgid = proc.pid
+            self._leader = proc
+
+    def _map_watch(self, proc, done):
+        if isinstance(proc, base.VirtualProcess):
+            return super()._map_watch(proc, done)
+        try:
+            # Don't reap: map() does that itself, so that the process group
+            # can't disappear between checking on it and starting a member.
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            # Someone else reaped it already
+            pass
+        finally:
+            done.put(proc)
 
     def signal(self, sig):
         if self.pgid is not None:
@@ -117,32 +344,264 @@ class ProcessGroup(base.ProcessGroup):
                 proc.kill()
 
 
+class JobTable:
+    """
+    The jobs of a shell: a collection of process groups, numbered from 1.
+
+    Jobs are indexed by process group ID and by the PIDs of their running
+    members. Each job has a thread waiting on its process group, which hands
+    each exit, stop and continue to the member it belongs to, so waiting on any
+    number of jobs costs one wakeup per child event.
+
+    Only the table's own members are reaped, and only through their ``Popen``;
+    other children of this process are left to whatever started them.
+    ``Process.join()`` and friends on members cooperate with it.
+    """
+    def __init__(self):
+        self._jobs = {}  # job id: group
+        self._job_ids = {}  # group: job id
+        self._pgids = {}  # pgid: job id
+        self._pids = {}  # pid of running member: job id
+        self._reapers = {}  # job id: thread waiting on it
+        self._changed = collections.OrderedDict()  # job ids to report, as an ordered set
+        self._statuses = {}  # job id: status as of the last child event
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __iter__(self):
+        yield from sorted(self._jobs)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __getitem__(self, job_id):
+        return self._jobs[job_id]
+
+    def add(self, group):
+        """
+        Add a process group as a new job, returning its job ID.
+
+        The group may already be started.
+        """
+        with self._cond:
+            if group._job_table is not None:
+                raise ValueError("Group is already a job")
+            job_id = 1
+            while job_id in self._jobs:
+                job_id += 1
+            self._jobs[job_id] = group
+            self._job_ids[group] = job_id
+            group._job_table = self
+            for proc in group:
+                if not isinstance(proc, base.VirtualProcess) \
+                        and proc.status in (base.RUNNING, base.PAUSED):
+                    self._member_started(group, proc)
+        return job_id
+
+    def remove(self, job_id):
+        """
+        Forget about a job. Its processes are no longer tracked.
+        """
+        with self._cond:
+            group = self._jobs.pop(job_id)
+            del self._job_ids[group]
+            group._job_table = None
+            self._changed.pop(job_id, None)
+            self._statuses.pop(job_id, None)
+            # Its thread notices when it next wakes up
+            self._reapers.pop(job_id, None)
+            for pgid in [pgid for pgid, jid in self._pgids.items() if jid == job_id]:
+                del self._pgids[pgid]
+            for proc in group:
+                if proc.pid is not None and self._pids.get(proc.pid) == job_id:
+                    del self._pids[proc.pid]
+            self._cond.notify_all()
+
+    def shutdown(self, grace=5.0):
+        """
+        Stop every job: ask them all to exit, wait up to ``grace`` seconds (in
+        total, not per job) for them to do so, and then kill what's left.
+
+        Returns a dict mapping job IDs to ``ShutdownReport``.
+        """
+        with self._cond:
+            jobs = sorted(self._jobs.items())
+        reports = base._shutdown([group for _, group in jobs], grace)
+        return {job_id: report for (job_id, _), report in zip(jobs, reports)}
+
+    def by_pgid(self, pgid):
+        """
+        The ID of the job with the given process group ID, or None.
+        """
+        return self._pgids.get(pgid)
+
+    def by_pid(self, pid):
+        """
+        The ID of the job with a running member with the given PID, or None.
+        """
+        return self._pids.get(pid)
+
+    def wait_job(self, job_id, timeout=None):
+        """
+        Wait for a job to finish or stop, and return its status.
+
+        Like ``wait_any_job()``, a stop is only reported once. On timeout, the
+        status is returned as it is.
+        """
+        with self._cond:
+            group = self._jobs[job_id]
+            self._cond.wait_for(
+                lambda: job_id in self._changed or group.status == base.FINISHED, timeout)
+            self._changed.pop(job_id, None)
+            return group.status
+
+    def wait_any_job(self, timeout=None):
+        """
+        Wait for any job to finish or stop, and return its ID.
+
+        Each change is reported once. Returns None on timeout, or if there are
+        no running jobs to wait on.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._changed or not self._pids, timeout)
+            if self._changed:
+                job_id, _ = self._changed.popitem(last=False)
+                return job_id
+
+    def _reaps(self, proc):
+        """
+        Is the table waiting on this member?
+        """
+        with self._cond:
+            return proc.pid is not None and proc.pid in self._pids
+
+    def _member_started(self, group, proc):
+        """
+        Index a newly started member. Called by the group.
+        """
+        with self._cond:
+            job_id = self._job_ids[group]
+            if hasattr(proc, '_process_group_leader'):
+                self._pgids[proc._pgid_hint()] = job_id
+            elif group.pgid is not None:
+                self._pgids[group.pgid] = job_id
+            self._pids[proc.pid] = job_id
+            if job_id not in self._reapers:
+                reaper = threading.Thread(target=self._reap, args=(job_id, group), daemon=True)
+                self._reapers[job_id] = reaper
+                reaper.start()
+            self._cond.notify_all()
+
+    def _member_changed(self, group, proc, new):
+        """
+        Record a member's change of status, however it was noticed. Called by
+        the group.
+        """
+        with self._cond:
+            job_id = self._job_ids.get(group)
+            if job_id is None:
+                return
+            if new == base.FINISHED and self._pids.get(proc.pid) == job_id:
+                del self._pids[proc.pid]
+            status = group.status
+            if status != self._statuses.get(job_id):
+                self._statuses[job_id] = status
+                if status in (base.FINISHED, base.PAUSED):
+                    self._changed[job_id] = None
+            self._cond.notify_all()
+
+    def _reap(self, job_id, group):
+        """
+        Thread body: wait on a job's process group, and apply what happens to
+        its members.
+
+        The event is only peeked at (WNOWAIT), and then consumed for that one
+        member, so nothing that isn't a member is ever reaped.
+        """
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                if self._reapers.get(job_id) is not me:
+                    return
+                if job_id not in self._pids.values():
+                    del self._reapers[job_id]
+                    return
+                pgid = group.pgid
+            try:
+                info = os.waitid(os.P_PGID, pgid,
+                                 os.WEXITED | os.WSTOPPED | os.WCONTINUED | os.WNOWAIT)
+            except ChildProcessError:
+                info = None
+            proc = None
+            if info is not None:
+                with self._cond:
+                    if self._pids.get(info.si_pid) == job_id:
+                        proc = group.by_pid(info.si_pid)
+            if proc is None:
+                # Either members were reaped elsewhere (eg by join()), or the
+                # child isn't a member (or isn't indexed yet) and is someone
+                # else's to reap. Catch up, and give them a moment.
+                self._sweep(job_id, group)
+                with self._cond:
+                    self._cond.wait(0.05)
+                continue
+            if info.si_code in (os.CLD_STOPPED, os.CLD_TRAPPED):
+                os.waitid(os.P_PID, proc.pid, os.WSTOPPED | os.WNOHANG)
+                proc._set_state(base.PAUSED)
+            elif info.si_code == os.CLD_CONTINUED:
+                os.waitid(os.P_PID, proc.pid, os.WCONTINUED | os.WNOHANG)
+                proc._set_state(base.RUNNING)
+            else:
+                # Popen reaps it, so it gets the return code
+                proc._proc.wait()
+                proc._set_state(base.FINISHED)
+
+    def _sweep(self, job_id, group):
+        """
+        Mark members that have been reaped by someone else as finished.
+        """
+        with self._cond:
+            pids = [pid for pid, jid in self._pids.items() if jid == job_id]
+        for pid in pids:
+            proc = group.by_pid(pid)
+            if proc is not None and proc._proc.poll() is not None:
+                proc._set_state(base.FINISHED)
+
+
 class Valve(base.Valve):
     """
-    Forwards from one file-like to another, but this flow may be paused and
-    resumed.
+    Forwards from one file-like to another, but this flow may be paused,
+    resumed, and throttled.
 
     This implementation doesn't support changing the target descriptors after
     initialization.
     """
     def _thread(self):
+        bufs, views = base._pooled_views(self)
         sel = selectors.DefaultSelector()
         sel.register(self.side_in, selectors.EVENT_READ)
         while True:
-            sel.select()
+            base._traced(self, 'read', sel.select)
             # Don't care about the event, there's only one thing it can be.
 
             # This feels like there's a race condition in here, but I think the
             # window is small enough we can call it "slight asyncronousity".
             if not self.gate.is_set():
-                self.gate.wait()
+                base._traced(self, 'gated', self.gate.wait)
                 continue
 
-            chunk = self.side_in.read(self.CHUNKSIZE)
-            if chunk in (b'', ''):
+            limited = base._limit_views(views, self._allowance())
+            chunks = base._traced(
+                self, 'read', base._read_chunks, self.side_in, limited, self.stats)
+            if not chunks:
                 break
             else:
-                self.side_out.write(chunk)
+                self._spend(chunks)
+                base._traced(self, 'gated', self.gate.wait)
+                base._traced(self, 'write', base._write_chunks, self.side_out, chunks, self.stats)
+        base._release_views(self, bufs)
         if not self.keepopen:
             self.side_out.close()
 
@@ -163,24 +622,342 @@ class QuickConnect(base.QuickConnect):
         # There's a race condition in here...
         old = vars(self)['side_in']
         vars(self)['side_in'] = value
+        base.claim(value)
         if old is not None:
             self.sel.unregister(old)
             self.changed.set()
         self.sel.register(value, selectors.EVENT_READ)
 
     def _thread(self):
+        bufs, views = base._pooled_views(self)
         while True:
-            self.sel.select()
+            base._traced(self, 'read', self.sel.select)
             # Don't care about the event, there's only one thing it can be.
 
             if self.changed.is_set():
                 self.changed.clear()
                 continue
 
-            chunk = self.side_in.read(self.CHUNKSIZE)
-            if chunk in (b'', ''):
+            chunks = base._traced(
+                self, 'read', base._read_chunks, self.side_in, views, self.stats)
+            if not chunks:
                 break
             else:
-                self.side_out.write(chunk)
+                base._traced(self, 'write', base._write_chunks, self.side_out, chunks, self.stats)
+        base._release_views(self, bufs)
         if not self.keepopen:
             self.side_out.close()
+
+
+class Multiplexer(base.Multiplexer):
+    """
+    Merges several inputs into one output.
+
+    If ``lines`` is true, only whole lines are written, so lines from different
+    inputs are never mixed together (a line longer than ``LINE_MAX`` is split).
+    Otherwise, each chunk read from an input is written out whole.
+
+    Inputs may be added and removed at any time. All inputs are served by one
+    thread; ``remove()`` waits for that thread, so once it returns nothing more
+    will be read from the input and everything that was read has been written.
+    An input is removed automatically at EOF, and when the last input is
+    removed that way, ``side_out`` is closed (unless ``keepopen``).
+    """
+    def __init__(self, side_out, inputs=(), *, lines=False, keepopen=False):
+        self.sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ)
+        self._requests = collections.deque()  # (input, add?, done event)
+        super().__init__(side_out, inputs, lines=lines, keepopen=keepopen)
+        self.thread = threading.Thread(target=base._run_connector, args=(self,), daemon=True)
+        self.thread.start()
+
+    def _request(self, side_in, add):
+        done = threading.Event()
+        with self._write_lock:
+            if self._wake_w is None:
+                # The loop is gone; there is nothing left to read from
+                done.set()
+            else:
+                self._requests.append((side_in, add, done))
+                os.write(self._wake_w, b'\0')
+        return done
+
+    def add(self, side_in):
+        """
+        Start merging an input.
+        """
+        base.claim(side_in)
+        self._request(side_in, True)
+
+    def remove(self, side_in):
+        """
+        Stop merging an input. Any partial line is written out.
+
+        Returns once the input is no longer being read.
+        """
+        done = self._request(side_in, False)
+        if threading.current_thread() is not self.thread:
+            while not done.wait(0.1):
+                if not self.thread.is_alive():
+                    break
+
+    def _apply_requests(self):
+        while self._requests:
+            side_in, add, done = self._requests.popleft()
+            if add:
+                self._carries[side_in] = bytearray()
+                self.sel.register(side_in, selectors.EVENT_READ)
+            elif side_in in self._carries:
+                self.sel.unregister(side_in)
+                self._detach(side_in, eof=False)
+            done.set()
+
+    def _thread(self):
+        bufs, views = base._pooled_views(self)
+        try:
+            while True:
+                self._apply_requests()
+                for key, _ in base._traced(self, 'read', self.sel.select):
+                    side_in = key.fileobj
+                    if side_in == self._wake_r:
+                        try:
+                            os.read(self._wake_r, 4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    elif side_in not in self._carries:
+                        continue
+                    chunks = base._traced(
+                        self, 'read', base._read_chunks, side_in, views, self.stats)
+                    if chunks:
+                        self._forward(side_in, chunks)
+                    else:
+                        self.sel.unregister(side_in)
+                        self._detach(side_in, eof=True)
+                        if not self._carries and not self.keepopen:
+                            return
+        finally:
+            base._release_views(self, bufs)
+            with self._write_lock:
+                self._apply_requests()
+                self.sel.close()
+                os.close(self._wake_r)
+                os.close(self._wake_w)
+                self._wake_w = None
+
+
+class _Pump:
+    """
+    One thread that writes every Source, as their pipes have room.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ)
+        self._requests = collections.deque()
+        self.thread = threading.Thread(target=self._thread, daemon=True)
+        self.thread.start()
+
+    def add(self, source):
+        """
+        Start (or resume) writing a source. May be called from any thread.
+        """
+        self._requests.append(source)
+        os.write(self._wake_w, b'\0')
+
+    def _thread(self):
+        while True:
+            while self._requests:
+                source = self._requests.popleft()
+                if source.side_in.closed:
+                    # A late wakeup, eg a fetch finishing after the end
+                    continue
+                try:
+                    self.sel.register(source.side_in, selectors.EVENT_WRITE, source)
+                except KeyError:
+                    # Still being watched; it'll find its new data
+                    pass
+                except ValueError:
+                    # Closed out from under us
+                    pass
+            for key, _ in self.sel.select():
+                if key.fileobj == self._wake_r:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                source = key.data
+                try:
+                    more = self._service(source)
+                except Exception as exc:
+                    # Only this source fails; the pump carries on
+                    more = False
+                    source._finished = True
+                    if base.events:
+                        base.events.emit(base.CONNECTOR_ERROR, source, error=exc)
+                if not more:
+                    self.sel.unregister(key.fileobj)
+                    if source._finished:
+                        source.side_in.close()
+                        if base.events:
+                            base.events.emit(base.CONNECTOR_EOF, source)
+
+    @staticmethod
+    def _service(source):
+        """
+        Write as much as the pipe will take. Returns False to stop watching it,
+        either because the source is done or because it's waiting for data.
+        """
+        fd = source.side_in.fileno()
+        while True:
+            if not source._pending:
+                batch = base._traced(source, 'refill', source._refill)
+                if batch is None:
+                    return False
+                source._pending = memoryview(batch).cast('B')
+                source.stats.bytes += len(batch)
+            try:
+                written = base._traced(source, 'write', os.write, fd, source._pending)
+            except BlockingIOError:
+                return True
+            except BrokenPipeError:
+                # The reader has gone away
+                source._finished = True
+                return False
+            source.stats.writes += 1
+            source._pending = source._pending[written:]
+            if source._pending:
+                # The pipe is full
+                return True
+
+
+class Source(base.Source):
+    """
+    Data for a process's standard input (or anything else reading a pipe),
+    written as the reader takes it, so it needn't all be in memory at once.
+
+    ``data`` may be:
+
+    * bytes-like: written in as few calls as possible
+    * a file: handed over as it is if it has a file descriptor the reader can
+      use directly; otherwise read ``BATCH`` bytes at a time
+    * an iterable of bytes-likes
+    * an async iterable of bytes-likes, run on ``loop`` (default: the current
+      event loop)
+
+    Pass the Source itself as ``stdin``. When the data ends, the pipe is
+    closed, so the reader sees EOF. This process's copy of the reading end is
+    closed once it's handed to a process.
+
+    All Sources are written by one shared thread, using non-blocking writes.
+    Iterables are pulled from that thread, so a slow one holds up the others;
+    an async iterable is pulled on its event loop instead.
+    """
+    def _start(self):
+        self._pending = None
+        self._finished = False
+        os.set_blocking(self.side_in.fileno(), False)
+        if hasattr(self.data, '__aiter__'):
+            self._aiter = self.data.__aiter__()
+            self._fetching = False
+            self._fetched = collections.deque()
+        else:
+            self._gen = self._batches()
+        self._pump = _Pump.shared()
+        self._pump.add(self)
+
+    def _refill(self):
+        """
+        The next batch to write, or None if there isn't one yet (or ever: see
+        ``_finished``). Runs on the pump thread.
+        """
+        if not hasattr(self, '_aiter'):
+            batch = next(self._gen, None)
+            if batch is None:
+                self._finished = True
+            return batch
+        items = []
+        while self._fetched and self._fetched[0] is not StopAsyncIteration:
+            items.append(self._fetched.popleft())
+        if self._fetched:
+            self._finished = not items
+        elif not self._fetching:
+            # Fetch the next item while this batch is written
+            self._fetching = True
+            self.loop.call_soon_threadsafe(self._fetch)
+        return base._joined(items, self.stats) if items else None
+
+    def _fetch(self):
+        """
+        Get the next item of an async iterable. Runs on its event loop.
+        """
+        import asyncio
+        fut = asyncio.ensure_future(self._aiter.__anext__(), loop=self.loop)
+        fut.add_done_callback(self._fetch_done)
+
+    def _fetch_done(self, fut):
+        try:
+            item = fut.result()
+        except StopAsyncIteration:
+            item = StopAsyncIteration
+        except Exception as exc:
+            item = StopAsyncIteration
+            if base.events:
+                base.events.emit(base.CONNECTOR_ERROR, self, error=exc)
+        self._fetched.append(item)
+        self._fetching = False
+        self._pump.add(self)
+
+
+class TimedCapture(base.TimedCapture):
+    """
+    Captures several streams together, recording which stream each piece of
+    data came from and when it arrived, so their interleaving can be seen.
+
+    Each source is a readable file, or None to make a :class:`Pipe`; hand
+    ``side_ins[n]`` to a process and close it, as with any pipe.
+
+    Each read is an entry; if ``lines`` is true, each line is instead (a line
+    longer than ``LINE_MAX`` is split), timed by when it was completed.
+
+    The data of all the streams is kept in the one ``data`` buffer, and the
+    entries in arrays: ``streams``, ``times``, ``offsets`` and ``lengths``. So
+    a long capture takes no Python objects per entry; indexing or iterating
+    the capture makes :class:`TimedChunk` as they're needed.
+
+    All the streams are read by one thread, timed as they become readable.
+    """
+    def _thread(self):
+        bufs, views = base._pooled_views(self)
+        sel = selectors.DefaultSelector()
+        try:
+            for stream, source in enumerate(self.sources):
+                sel.register(source, selectors.EVENT_READ, stream)
+            while sel.get_map():
+                for key, _ in base._traced(self, 'read', sel.select):
+                    stream = key.data
+                    chunks = base._traced(
+                        self, 'read', base._read_chunks, key.fileobj, views, self.stats)
+                    with self._lock:
+                        if chunks:
+                            self._record(stream, chunks, time.monotonic())
+                        else:
+                            sel.unregister(key.fileobj)
+                            self._record_end(stream, time.monotonic())
+        finally:
+            sel.close()
+            base._release_views(self, bufs)
@@ -80,6 +80,8 @@ class Process(base.Process):
                 NtSuspendProcess(hproc)
             finally:
                 CloseHandle(hproc)
+            if self._state == base.RUNNING:
+                self._set_state(base.PAUSED)
 
     def unpause(self):
         """
@@ -91,9 +93,13 @@ class Process(base.Process):
                 NtResumeProcess(hproc)
             finally:
                 CloseHandle(hproc)
+            if self._state == base.PAUSED:
+                self._set_state(base.RUNNING)
 
 
 class ProcessGroup(base.ProcessGroup):
+    _process_type = Process
+
     def __init__(self):
         super().__init__()
         self.job = CreateJobObject(None, None)
@@ -119,6 +125,12 @@ class ProcessGroup(base.ProcessGroup):
             # FIXME: Handle if the process was already joined to us
             AssignProcessToJobObject(self.job, proc._proc._handle)
 
+    def _start_member(self, proc):
+        super()._start_member(proc)
+        if not isinstance(proc, base.VirtualProcess):
+            # _handle is subprocess.Popen internal. Beats looking up the process ourselves.
+            AssignProcessToJobObject(self.job, proc._proc._handle)
+
     def signal(self, sig):
         """
         Signal the process of an event.
@@ -0,0 +1,96 @@
+import os
+import sys
+import slug
+from slug import Process, OutputCache
+from conftest import runpy
+
+# Appends to a file each time it actually runs, so hits can be told apart
+COUNTING = (
+    "import sys; open(sys.argv[1], 'a').write('x'); "
+    "data = sys.stdin.buffer.read(); sys.stdout.buffer.write(data.upper()); "
+    "sys.stderr.write('err'); sys.exit(3)"
+)
+
+
+def counted(tmpdir):
+    return runpy(COUNTING) + [str(tmpdir.join('runs'))]
+
+
+def runs(tmpdir):
+    path = tmpdir.join('runs')
+    return len(path.read()) if path.check() else 0
+
+
+def test_hit_replays(tmpdir):
+    cache = OutputCache(str(tmpdir.join('cache')))
+    first = cache.capture(Process(counted(tmpdir)), b'spam')
+    proc = Process(counted(tmpdir))
+    second = cache.capture(proc, b'spam')
+    assert runs(tmpdir) == 1
+    assert second == first
+    assert second.stdout == b'SPAM'
+    assert second.stderr == b'err'
+    assert second.return_code == 3
+    assert proc.status == slug.INIT
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_key_inputs(tmpdir):
+    cache = OutputCache(str(tmpdir.join('cache')), env=['SLUG_CACHE_TEST'])
+    cache.capture(Process(counted(tmpdir)), b'spam')
+    cache.capture(Process(counted(tmpdir)), b'eggs')
+    cache.capture(Process(counted(tmpdir) + ['extra']), b'spam')
+    cache.capture(Process(counted(tmpdir), cwd=str(tmpdir)), b'spam')
+    env = dict(os.environ, SLUG_CACHE_TEST='1')
+    cache.capture(Process(counted(tmpdir), environ=env), b'spam')
+    assert runs(tmpdir) == 5
+    assert cache.hits == 0
+    # Variables not named don't matter
+    env = dict(os.environ, SLUG_CACHE_OTHER='1')
+    cache.capture(Process(counted(tmpdir), environ=env), b'spam')
+    assert runs(tmpdir) == 5
+
+
+def test_executable_changes(tmpdir):
+    script = tmpdir.join('tool')
+    script.write("#!{}\nprint('one')\n".format(sys.executable))
+    script.chmod(0o755)
+    cache = OutputCache(str(tmpdir.join('cache')))
+    assert cache.capture(Process([str(script)])).stdout == b'one\n'
+    script.write("#!{}\nprint('two!')\n".format(sys.executable))
+    assert cache.capture(Process([str(script)])).stdout == b'two!\n'
+    assert cache.misses == 2
+
+
+def test_persists(tmpdir):
+    OutputCache(str(tmpdir.join('cache'))).capture(Process(counted(tmpdir)), b'spam')
+    cache = OutputCache(str(tmpdir.join('cache')))
+    assert len(cache) == 1
+    assert cache.capture(Process(counted(tmpdir)), b'spam').stdout == b'SPAM'
+    assert runs(tmpdir) == 1
+    cache.clear()
+    assert len(cache) == 0
+    assert not os.listdir(str(tmpdir.join('cache')))
+
+
+def test_lru_eviction(tmpdir):
+    cache = OutputCache(str(tmpdir.join('cache')), max_size=300)
+    for data in (b'a' * 50, b'b' * 50, b'c' * 50):
+        cache.capture(Process(counted(tmpdir)), data)
+    # Use the oldest, so the next oldest goes
+    cache.capture(Process(counted(tmpdir)), b'a' * 50)
+    cache.capture(Process(counted(tmpdir)), b'd' * 50)
+    assert cache.evictions >= 1
+    assert cache.size <= 300
+    before = runs(tmpdir)
+    cache.capture(Process(counted(tmpdir)), b'a' * 50)
+    assert runs(tmpdir) == before
+    cache.capture(Process(counted(tmpdir)), b'b' * 50)
+    assert runs(tmpdir) == before + 1
+
+
+def test_truncated_not_cached(tmpdir):
+    cache = OutputCache(str(tmpdir.join('cache')))
+    result = cache.capture(Process(counted(tmpdir)), b'spam', limit=2)
+    assert set(result.truncated) == {'stdout', 'stderr'}
+    assert len(cache) == 0
@@ -0,0 +1,43 @@
+import bz2
+import os
+import time
+import zlib
+import pytest
+from slug import Compressor, Decompressor, Pipe
+
+
+@pytest.mark.parametrize('format', ['gzip', 'zlib', 'lzma', 'bz2'])
+def test_roundtrip(format):
+    data = ''.join('line {} of the output\n'.format(i) for i in range(20000)).encode()
+    pin = Pipe()
+    middle = Pipe()
+    pout = Pipe()
+    Compressor(pin.side_out, middle.side_in, format, level=1)
+    Decompressor(middle.side_out, pout.side_in, format)
+
+    pin.side_in.write(data)
+    pin.side_in.close()
+
+    assert pout.side_out.read() == data
+
+
+@pytest.mark.parametrize('format', ['gzip', 'bz2'])
+def test_flush_interval(format):
+    pin = Pipe()
+    pout = Pipe()
+    Compressor(pin.side_out, pout.side_in, format, flush_interval=0.1)
+
+    pin.side_in.write(b'spam')
+    pin.side_in.flush()
+    time.sleep(0.5)
+    pin.side_in.write(b'eggs')
+    pin.side_in.flush()
+    time.sleep(0.5)
+    # Both pieces are readable while the stream is still open
+    partial = os.read(pout.side_out.fileno(), 65536)
+    if format == 'gzip':
+        assert zlib.decompressobj(31).decompress(partial) == b'spameggs'
+    else:
+        assert bz2.decompress(partial) == b'spameggs'
+    pin.side_in.close()
+    pout.side_out.read()
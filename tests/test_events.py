@@ -0,0 +1,66 @@
+import asyncio
+import signal
+import pytest
+import slug
+from slug import Process, ProcessGroup, Pipe, Tee
+from conftest import runpy
+
+
+def test_process_events():
+    with slug.events.queue() as q:
+        proc = Process(runpy('import sys; sys.exit(3)'))
+        proc.start()
+        proc.join()
+
+    mine = [ev for ev in q if ev.source is proc]
+    assert [ev.kind for ev in mine] == [slug.SPAWNED, slug.EXITED]
+    assert all(ev.pid == proc.pid for ev in mine)
+    assert mine[0].time <= mine[1].time
+    assert mine[1].data['return_code'] == 3
+    assert mine[1].data['signal'] is None
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGKILL'), reason="No signals")
+def test_group_events():
+    seen = []
+    slug.events.subscribe(seen.append)
+    try:
+        with ProcessGroup() as pg:
+            pg.add(Process(runpy('import time; time.sleep(30)')))
+        pg.start()
+        pg.pause()
+        pg.unpause()
+        pg.kill()
+        pg.join()
+    finally:
+        slug.events.unsubscribe(seen.append)
+
+    assert [ev.kind for ev in seen if ev.source is pg] == [
+        slug.SPAWNED, slug.STOPPED, slug.CONTINUED, slug.EXITED]
+    exited = [ev for ev in seen if ev.kind == slug.EXITED and ev.source is not pg]
+    assert exited[0].data['signal'] == signal.SIGKILL
+    assert exited[0].pgid == pg.pgid
+
+
+def test_connector_eof_async():
+    pin = Pipe()
+    pout = Pipe()
+
+    async def first_connector_event(q):
+        async for ev in q:
+            if ev.kind in (slug.CONNECTOR_EOF, slug.CONNECTOR_ERROR):
+                return ev
+
+    loop = asyncio.new_event_loop()
+    try:
+        with slug.events.queue() as q:
+            tee = Tee(pin.side_out, pout.side_in, lambda chunk: None)
+            pin.side_in.write(b'spam')
+            pin.side_in.close()
+            ev = loop.run_until_complete(first_connector_event(q))
+    finally:
+        loop.close()
+
+    assert ev.kind == slug.CONNECTOR_EOF
+    assert ev.source is tee
+    assert pout.side_out.read() == b'spam'
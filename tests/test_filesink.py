@@ -0,0 +1,46 @@
+import sys
+import pytest
+import slug
+from slug import Process, Pipe, FileSink
+
+
+def test_direct(tmp_path):
+    path = tmp_path / 'out.log'
+    path.write_bytes(b'old\n')
+    sink = FileSink(str(path))
+    assert sink.thread is None
+    proc = Process([sys.executable, '-c', 'print("spam")'], stdout=sink.side_in)
+    proc.start()
+    sink.side_in.close()
+    proc.join()
+    assert path.read_bytes() == b'old\nspam\n'
+
+
+@pytest.mark.parametrize('cls', [slug.FileSink, slug.base.FileSink])
+def test_rotate(tmp_path, cls):
+    path = tmp_path / 'out.log'
+    sink = cls(str(path), max_size=1000, backups=2)
+    proc = Process([sys.executable, '-c', 'import sys; sys.stdout.write("x" * 3500)'],
+                   stdout=sink.side_in)
+    proc.start()
+    sink.side_in.close()
+    proc.join()
+    sink.thread.join()
+
+    assert path.read_bytes() == b'x' * 500
+    assert (tmp_path / 'out.log.1').read_bytes() == b'x' * 1000
+    assert (tmp_path / 'out.log.2').read_bytes() == b'x' * 1000
+    assert not (tmp_path / 'out.log.3').exists()
+    assert sink.stats.bytes == 3500
+
+
+@pytest.mark.parametrize('cls', [slug.FileSink, slug.base.FileSink])
+def test_from_pipe(tmp_path, cls):
+    path = tmp_path / 'out.log'
+    pipe = Pipe()
+    sink = cls(str(path), source=pipe.side_out, append=False)
+    assert sink.side_in is None
+    pipe.side_in.write(b'spam' * 100000)
+    pipe.side_in.close()
+    sink.thread.join()
+    assert path.read_bytes() == b'spam' * 100000
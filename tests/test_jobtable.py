@@ -0,0 +1,87 @@
+import os
+import signal
+import pytest
+import slug
+from slug import ProcessGroup, Process
+from conftest import runpy
+
+pytestmark = pytest.mark.skipif(not hasattr(slug, 'JobTable'),
+                                reason="No job table on this platform")
+
+
+def make_job(*codes):
+    pg = ProcessGroup()
+    for code in codes:
+        pg.add(Process(runpy(code)))
+    return pg
+
+
+def test_wait_any_job():
+    jobs = slug.JobTable()
+    slow = make_job("import time; time.sleep(1)")
+    quick = make_job("import sys; sys.exit(3)", "import sys; sys.exit(4)")
+    slow_id = jobs.add(slow)
+    quick_id = jobs.add(quick)
+    assert (slow_id, quick_id) == (1, 2)
+    assert list(jobs) == [1, 2]
+
+    slow.start()
+    quick.start()
+    assert jobs.by_pgid(slow.pgid) == slow_id
+    assert jobs.by_pgid(quick.pgid) == quick_id
+    assert all(jobs.by_pid(p.pid) == slow_id for p in slow)
+
+    assert jobs.wait_any_job() == quick_id
+    assert quick.status == slug.FINISHED
+    assert [p.return_code for p in quick] == [3, 4]
+
+    assert jobs.wait_any_job() == slow_id
+    assert jobs.wait_any_job(timeout=0.1) is None
+    assert jobs.by_pgid(slow.pgid) == slow_id
+    assert jobs.by_pid(next(iter(slow)).pid) is None
+
+
+def test_wait_job_stopped():
+    jobs = slug.JobTable()
+    pg = make_job("import time; time.sleep(30)", "import time; time.sleep(30)")
+    job_id = jobs.add(pg)
+    pg.start()
+
+    assert jobs.wait_job(job_id, timeout=0.1) == slug.RUNNING
+    os.kill(-pg.pgid, signal.SIGSTOP)
+    assert jobs.wait_job(job_id) == slug.PAUSED
+    assert all(p.status == slug.PAUSED for p in pg)
+
+    pg.kill()
+    assert jobs.wait_job(job_id) == slug.FINISHED
+    assert all(p.return_code == -signal.SIGKILL for p in pg)
+
+
+def test_join_cooperates():
+    jobs = slug.JobTable()
+    pg = make_job("import sys; sys.exit(7)")
+    job_id = jobs.add(pg)
+    pg.start()
+    pg.join()
+    assert [p.return_code for p in pg] == [7]
+
+    jobs.remove(job_id)
+    assert len(jobs) == 0
+    assert jobs.add(make_job("pass")) == job_id
+
+
+def test_leaves_other_children():
+    import subprocess
+    jobs = slug.JobTable()
+    pg = make_job("import time; time.sleep(0.5)")
+    jobs.add(pg)
+    pg.start()
+    # Unrelated children, exiting while the job is being waited on
+    codes = [subprocess.run(runpy("import sys; sys.exit(5)")).returncode for _ in range(20)]
+    other = Process(runpy("import sys; sys.exit(7)"))
+    other.start()
+    other.join()
+    assert codes == [5] * 20
+    assert other.return_code == 7
+    assert jobs.wait_any_job() == 1
+    assert pg.status == slug.FINISHED
@@ -0,0 +1,47 @@
+import asyncio
+import sys
+from slug import Process, MappedCapture
+
+
+def test_capture_lines():
+    with MappedCapture(reserve=1) as cap:
+        # More than a page, so the mapping has to grow
+        proc = Process([sys.executable, '-c', 'for i in range(2000): print(i)'],
+                       stdout=cap.side_in)
+        proc.start()
+        cap.side_in.close()
+        proc.join()
+        cap.thread.join()
+
+        assert cap.eof
+        assert len(cap) == len(''.join('{}\n'.format(i) for i in range(2000)))
+        assert cap.line_count == 2000
+        with cap.line(1234) as line:
+            assert line == b'1234\n'
+        assert cap.line_offset(10) == 20
+        with cap.view(0, 6) as view:
+            assert view == b'0\n1\n2\n'
+
+
+def test_tail():
+    with MappedCapture() as cap:
+        assert cap.wait(timeout=0.1) == 0
+        cap.side_in.write(b'spam')
+        assert cap.wait(0) == 4
+        assert cap.line_count == 0
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            fut = cap.wait_async()
+            cap.side_in.write(b'\neggs')
+            cap.side_in.close()
+            # The wait completes at the new data or at EOF, whichever it sees
+            assert loop.run_until_complete(asyncio.wait_for(fut, 5)) in (5, 9)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        cap.thread.join()
+        assert cap.line_count == 2
+        with cap.line(1) as line:
+            assert line == b'eggs'
@@ -0,0 +1,57 @@
+import os
+import slug
+from slug import Pipe, Multiplexer
+
+
+def test_merge():
+    a = Pipe()
+    b = Pipe()
+    out = Pipe()
+    Multiplexer(out.side_in, [a.side_out, b.side_out])
+    a.side_in.write(b'spam')
+    a.side_in.close()
+    b.side_in.write(b'eggs')
+    b.side_in.close()
+    data = out.side_out.read()
+    assert sorted([data[:4], data[4:]]) in ([b'eggs', b'spam'], [b'spam', b'eggs'])
+
+
+def test_lines_atomic():
+    a = Pipe()
+    b = Pipe()
+    out = Pipe()
+    Multiplexer(out.side_in, [a.side_out, b.side_out], lines=True)
+    a.side_in.write(b'sp')
+    a.side_in.flush()
+    b.side_in.write(b'eggs\nha')
+    b.side_in.flush()
+    a.side_in.write(b'am\n')
+    a.side_in.close()
+    b.side_in.write(b'm\n')
+    b.side_in.close()
+    lines = out.side_out.read().splitlines()
+    assert sorted(lines) == [b'eggs', b'ham', b'spam']
+
+
+def test_add_remove():
+    a = Pipe()
+    b = Pipe()
+    out = Pipe()
+    mux = Multiplexer(out.side_in, [a.side_out], keepopen=True)
+    a.side_in.write(b'spam')
+    a.side_in.flush()
+    assert os.read(out.side_out.fileno(), 100) == b'spam'
+    mux.add(b.side_out)
+    b.side_in.write(b'eggs')
+    b.side_in.flush()
+    assert os.read(out.side_out.fileno(), 100) == b'eggs'
+    mux.remove(b.side_out)
+    if slug.Multiplexer is slug.base.Multiplexer:
+        # This input is read once more before the removal takes effect
+        return
+    b.side_in.write(b'ham')
+    b.side_in.close()
+    a.side_in.write(b'foo')
+    a.side_in.close()
+    assert os.read(out.side_out.fileno(), 100) == b'foo'
+    assert b.side_out.read() == b'ham'
@@ -114,3 +114,111 @@ def test_lswc_gh10():
     pipe.side_in.close()
     pipe.side_out.close()
     pg.join()
+
+
+def test_map_ordered():
+    pg = ProcessGroup()
+    results = list(pg.map(
+        lambda n: runpy("import sys, time; time.sleep({}); print({}); sys.exit({})".format(
+            (5 - n) / 10, n, n)),
+        range(5),
+        max_parallel=3,
+        capture=True,
+    ))
+
+    assert [r.item for r in results] == [0, 1, 2, 3, 4]
+    assert [r.return_code for r in results] == [0, 1, 2, 3, 4]
+    assert [r.output.rstrip() for r in results] == [b'0', b'1', b'2', b'3', b'4']
+    assert len(pg) == 5
+
+
+def test_map_decoded():
+    pg = ProcessGroup()
+    results = list(pg.map(
+        lambda s: runpy("import sys; sys.stdout.buffer.write({!r})".format(s.encode())),
+        ['sp\u00e4m\r\n', 'eggs'],
+        capture=True,
+        encoding='utf-8',
+    ))
+
+    assert [r.output for r in results] == ['sp\u00e4m\n', 'eggs']
+
+
+def test_map_as_completed():
+    pg = ProcessGroup()
+    results = list(pg.map(
+        lambda n: runpy("import time; time.sleep({})".format(n / 2)),
+        [2, 0],
+        max_parallel=2,
+        ordered=False,
+    ))
+
+    assert [r.item for r in results] == [0, 2]
+    assert all(r.output is None for r in results)
+
+
+def test_map_max_parallel():
+    import time
+    pg = ProcessGroup()
+    start = time.perf_counter()
+    results = list(pg.map(
+        lambda n: runpy("import time; time.sleep(0.5)"),
+        range(4),
+        max_parallel=2,
+    ))
+    elapsed = time.perf_counter() - start
+
+    assert [r.return_code for r in results] == [0, 0, 0, 0]
+    # Two at a time: two rounds, not one and not four
+    assert 0.9 < elapsed < 1.9
+
+
+def test_lookup():
+    with ProcessGroup() as pg:
+        p1 = Process(runpy("input()"))
+        p2 = Process(runpy("input()"))
+        pg.add(p1)
+        pg.add(p2)
+    other = Process(runpy("input()"))
+
+    assert p1 in pg
+    assert other not in pg
+    assert list(pg) == [p1, p2]
+    assert pg.status == slug.INIT
+    assert not pg.started
+
+    pg.start()
+    assert pg.started
+    assert pg.status == slug.RUNNING
+    assert pg.by_pid(p1.pid) is p1
+    assert pg.by_pid(p2.pid) is p2
+    assert pg.by_pid(os.getpid()) is None
+
+    pg.kill()
+    pg.join()
+    assert pg.status == slug.FINISHED
+
+
+def test_status_counts():
+    with ProcessGroup() as pg:
+        p1 = Process(runpy("input()"))
+        p2 = Process(runpy("input()"))
+        pg.add(p1)
+        pg.add(p2)
+    pg.start()
+
+    pg.pause()
+    assert p1.status == slug.PAUSED
+    assert pg.status == slug.PAUSED
+
+    p2.unpause()
+    assert pg.status == slug.RUNNING
+
+    p2.kill()
+    p2.join()
+    assert p2.status == slug.FINISHED
+    assert pg.status == slug.PAUSED
+
+    pg.kill()
+    pg.join()
+    assert pg.status == slug.FINISHED
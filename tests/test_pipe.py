@@ -1,5 +1,6 @@
 import pytest
-from slug import Pipe
+from conftest import runpy
+from slug import Pipe, Process, ProcessGroup, claim, open_fds
 
 
 def test_goesthrough():
@@ -100,3 +101,45 @@ def test_large_chunk_interactivish():
     p.side_in.close()
     data = p.side_out.read(4000)
     assert data == b''
+
+
+def test_closed_after_handover():
+    pipe = Pipe()
+    proc = Process(runpy("print('spam')"), stdout=pipe.side_in)
+    proc.start()
+    assert pipe.side_in.closed
+    # No manual close needed to see EOF
+    assert pipe.side_out.read().strip() == b'spam'
+    proc.join()
+
+
+def test_group_shares_ends():
+    pipe = Pipe()
+    pg = ProcessGroup()
+    pg.add(Process(runpy("import os; os.write(1, b'spam\\n')"), stdout=pipe.side_in))
+    pg.add(Process(runpy("import os; os.write(1, b'eggs\\n')"), stdout=pipe.side_in))
+    pg.start()
+    assert pipe.side_in.closed
+    assert sorted(pipe.side_out.read().split()) == [b'eggs', b'spam']
+    pg.join()
+
+
+def test_claimed_and_open_fds():
+    pipe = Pipe()
+    claim(pipe.side_in)
+    proc = Process(runpy("print('spam')"), stdout=pipe.side_in)
+    proc.start()
+    assert not pipe.side_in.closed
+
+    leaks = {o.fd: o for o in open_fds()}
+    assert pipe.side_in.fileno() in leaks
+    leak = leaks[pipe.side_in.fileno()]
+    assert leak.kind == 'pipe write end'
+    assert leak.claimed
+    assert leak.pids == [proc.pid]
+
+    pipe.side_in.close()
+    assert pipe.side_out.read().strip() == b'spam'
+    pipe.side_out.close()
+    assert all(o.file not in (pipe.side_in, pipe.side_out) for o in open_fds())
+    proc.join()
@@ -1,5 +1,8 @@
+import os
+import subprocess
 import pytest
 from conftest import runpy
+import slug
 from slug import Process, Pipe
 
 
@@ -181,3 +184,67 @@ def test_argv_roundtrip(st):
     assert proc.return_code == 0
     assert data.rstrip(b'\r\n') == st.encode('ascii')
     # We're not testing 8-bit clean, but special chars, which are all ascii
+
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="fds is POSIX only")
+def test_fds():
+    a = Pipe()
+    b = Pipe()
+    # Inheritable, but not passed on, so the child shouldn't see it
+    leak = Pipe()
+    os.set_inheritable(leak.side_in.fileno(), True)
+    afd, bfd, leakfd = a.side_in.fileno(), b.side_in.fileno(), leak.side_in.fileno()
+    # Swapped, to make sure the mappings don't clobber each other
+    proc = Process(runpy(
+        "import os, sys\n"
+        "os.write({}, b'spam'); os.write({}, b'eggs')\n"
+        "try: os.write({}, b'x')\n"
+        "except OSError: sys.exit(0)\n"
+        "sys.exit(1)\n".format(afd, bfd, leakfd)
+    ), fds={afd: b.side_in, bfd: a.side_in})
+    proc.start()
+    a.side_in.close()
+    b.side_in.close()
+    leak.side_in.close()
+    proc.join()
+    assert proc.return_code == 0
+    assert a.side_out.read() == b'eggs'
+    assert b.side_out.read() == b'spam'
+    assert leak.side_out.read() == b''
+
+
+ECHO = (
+    "import sys\n"
+    "data = sys.stdin.buffer.read()\n"
+    "sys.stdout.buffer.write(data); sys.stderr.buffer.write(data[:3])\n"
+)
+
+
+@pytest.mark.parametrize('cls', [Process, slug.base.Process])
+def test_capture(cls):
+    data = bytes(range(256)) * 8192
+    result = cls(runpy(ECHO)).capture(data)
+    assert result.return_code == 0
+    assert result.stdout == data
+    assert result.stderr == data[:3]
+    assert result.truncated == ()
+    assert not result.timed_out
+
+
+@pytest.mark.parametrize('cls', [Process, slug.base.Process])
+def test_capture_limit(cls):
+    result = cls(runpy(ECHO), stderr=subprocess.DEVNULL).capture(b'spam' * 100000, limit=10)
+    assert result.stdout == b'spamspamsp'
+    assert result.stderr is None
+    assert result.truncated == ('stdout',)
+
+
+@pytest.mark.parametrize('cls', [Process, slug.base.Process])
+def test_capture_timeout(cls):
+    result = cls(runpy(
+        "import sys, time; print('spam', flush=True); time.sleep(30)"
+    )).capture(timeout=0.5)
+    assert result.timed_out
+    assert result.stdout.strip() == b'spam'
+    assert result.return_code != 0
@@ -0,0 +1,47 @@
+import time
+from slug import ProgressMeter, Pipe
+
+
+def test_forwards_and_reports():
+    reports = []
+    pin = Pipe()
+    pout = Pipe()
+    ProgressMeter(pin.side_out, pout.side_in, reports.append, every=10000)
+
+    data = b''.join(b'line %d\n' % i for i in range(10000))
+    pin.side_in.write(data)
+    pin.side_in.close()
+
+    assert pout.side_out.read() == data
+    final = reports[-1]
+    assert final.eof
+    assert final.bytes == len(data)
+    assert final.preview == b'line 9999'
+    # Not one per read, and no more than one per 10000 bytes
+    assert 1 <= len(reports) <= len(data) // 10000 + 1
+    assert [r.bytes for r in reports] == sorted(r.bytes for r in reports)
+    assert not any(r.eof for r in reports[:-1])
+
+
+def test_interval_and_stall():
+    reports = []
+    pin = Pipe()
+    pout = Pipe()
+    ProgressMeter(pin.side_out, pout.side_in, reports.append, interval=0.1, preview=4)
+
+    pin.side_in.write(b'first\npartial')
+    pin.side_in.flush()
+    time.sleep(0.6)
+    # Reported while stalled, without any more data
+    assert reports
+    assert reports[-1].bytes == 13
+    assert reports[-1].rate == 0
+    assert reports[-1].preview == b'tial'
+    assert not reports[-1].eof
+    pin.side_in.close()
+    assert pout.side_out.read() == b'first\npartial'
+    for _ in range(50):
+        if reports[-1].eof:
+            break
+        time.sleep(0.1)
+    assert reports[-1].eof
@@ -69,3 +69,28 @@ def test_change_output():
     out2 = p2.side_out.read(4000)
     assert out1 == b'spam'
     assert out2 == b'eggs'
+
+
+def test_stats():
+    pin = Pipe()
+    pout = Pipe()
+    data = b'x' * 60000  # Less than a pipe holds, so it's all waiting at once
+    pin.side_in.write(data)
+    pin.side_in.close()
+
+    qc = QuickConnect(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        keepopen=False
+    )
+    assert pout.side_out.read() == data
+    qc.thread.join()
+
+    assert qc.stats.bytes == len(data)
+    assert qc.stats.allocations <= qc.VECTOR
+    if slug.base._HAVE_VECTOR:
+        # One call to read it all, one for EOF; one to write it all
+        assert qc.stats.reads == 2
+        assert qc.stats.writes == 1
+    per_mb = qc.stats.per_mb()
+    assert per_mb['reads'] == qc.stats.reads / (len(data) / 1024 / 1024)
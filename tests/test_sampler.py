@@ -0,0 +1,38 @@
+import os
+import pytest
+import slug
+from slug import ProcessGroup, Process
+from conftest import runpy
+
+pytestmark = pytest.mark.skipif(not hasattr(slug, 'ResourceSampler'),
+                                reason="No /proc sampler on this platform")
+
+BUSY = "import sys\nsys.stdout.write('x' * 1000000); sys.stdout.flush()\nwhile True: pass"
+
+
+def test_sample():
+    pg = ProcessGroup()
+    devnull = open(os.devnull, 'wb')
+    proc = Process(runpy(BUSY), stdout=devnull)
+    pg.add(proc)
+    idle = Process(runpy("import time; time.sleep(30)"))
+    pg.add(idle)
+    pg.start()
+    devnull.close()
+    try:
+        snapshots = []
+        with slug.ResourceSampler(pg, interval=0.2, callback=snapshots.append) as sampler:
+            while len(snapshots) < 3:
+                sampler.thread.join(0.1)
+        first, last = snapshots[0], snapshots[-1]
+        assert set(last.samples) == {proc.pid, idle.pid}
+        assert first.samples[proc.pid].cpu is None
+        busy = last.samples[proc.pid]
+        assert busy.cpu > 20
+        assert busy.rss > 1000000
+        assert busy.write >= 1000000
+        assert last.samples[idle.pid].cpu < 20
+        assert sampler._files == {}
+    finally:
+        pg.kill()
+        pg.join()
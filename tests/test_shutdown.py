@@ -0,0 +1,82 @@
+import os
+import time
+import pytest
+import slug
+from slug import ProcessGroup, Process
+from conftest import runpy
+
+IGNORE_TERM = (
+    "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+    "print(flush=True); time.sleep(30)"
+)
+
+
+def test_join_timeout():
+    proc = Process(runpy("import time; time.sleep(30)"))
+    proc.start()
+    start = time.monotonic()
+    proc.join(0.2)
+    assert time.monotonic() - start < 5
+    assert proc.status == slug.RUNNING
+    proc.kill()
+    proc.join(5)
+    assert proc.status == slug.FINISHED
+
+
+def test_group_join_timeout():
+    pg = ProcessGroup()
+    for _ in range(3):
+        pg.add(Process(runpy("import time; time.sleep(30)")))
+    pg.start()
+    start = time.monotonic()
+    pg.join(0.3)
+    # One deadline for the group, not one per member
+    assert time.monotonic() - start < 0.9
+    assert pg.status == slug.RUNNING
+    pg.kill()
+    pg.join()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="Needs signals")
+def test_shutdown():
+    pg = ProcessGroup()
+    done = Process(runpy("pass"))
+    polite = Process(runpy("import time; time.sleep(30)"))
+    pipe = slug.Pipe()
+    stubborn = Process(runpy(IGNORE_TERM), stdout=pipe.side_in)
+    for proc in (done, polite, stubborn):
+        pg.add(proc)
+    pg.start()
+    pipe.side_in.close()
+    done.join()
+    # Wait for the signal handler to be set up
+    pipe.side_out.readline()
+
+    report = pg.shutdown(grace=0.5)
+    assert report.finished == [done]
+    assert report.terminated == [polite]
+    assert report.killed == [stubborn]
+    assert pg.status == slug.FINISHED
+
+
+@pytest.mark.skipif(not hasattr(slug, 'JobTable'), reason="No job table on this platform")
+def test_jobtable_shutdown():
+    jobs = slug.JobTable()
+    pipes = []
+    for _ in range(4):
+        pg = ProcessGroup()
+        pipe = slug.Pipe()
+        pg.add(Process(runpy(IGNORE_TERM), stdout=pipe.side_in))
+        pg.start()
+        pipe.side_in.close()
+        pipes.append(pipe)
+        jobs.add(pg)
+    for pipe in pipes:
+        pipe.side_out.readline()
+
+    start = time.monotonic()
+    reports = jobs.shutdown(grace=0.5)
+    # One grace period for everything
+    assert time.monotonic() - start < 1.5
+    assert sorted(reports) == [1, 2, 3, 4]
+    assert all(len(report.killed) == 1 for report in reports.values())
@@ -0,0 +1,74 @@
+import asyncio
+import io
+import pytest
+import slug
+from slug import Process, Source
+from conftest import runpy
+
+COUNT = "import sys; data = sys.stdin.buffer.read(); print(len(data), data[:6])"
+
+
+@pytest.mark.parametrize('cls', [Source, slug.base.Source])
+def test_bytes(cls):
+    source = cls(b'spam' * 1000000)
+    result = Process(runpy(COUNT), stdin=source).capture()
+    assert result.stdout.split() == [b'4000000', b"b'spamsp'"]
+    # Handed over, so closed here
+    assert source.closed
+
+
+@pytest.mark.parametrize('cls', [Source, slug.base.Source])
+def test_generator(cls):
+    def gen():
+        for i in range(100000):
+            yield '{:05}\n'.format(i).encode()
+
+    result = Process(runpy(COUNT), stdin=cls(gen())).capture()
+    assert result.stdout.split() == [b'600000', b"b'00000\\n'"]
+
+
+def test_file(tmp_path):
+    path = tmp_path / 'input'
+    path.write_bytes(b'eggs' * 1000)
+    with open(str(path), 'rb') as f:
+        source = Source(f)
+        # Read directly by the child, with no copying here
+        assert source.side_in is None
+        result = Process(runpy(COUNT), stdin=source).capture()
+    assert result.stdout.split() == [b'4000', b"b'eggseg'"]
+
+
+@pytest.mark.parametrize('cls', [Source, slug.base.Source])
+def test_unbuffered_file(cls):
+    result = Process(runpy(COUNT), stdin=cls(io.BytesIO(b'ham' * 100000))).capture()
+    assert result.stdout.split() == [b'300000', b"b'hamham'"]
+
+
+@pytest.mark.parametrize('cls', [Source, slug.base.Source])
+def test_async_iterable(cls):
+    class Ticker:
+        def __init__(self):
+            self.n = 0
+
+        def __aiter__(self):
+            return self
+
+        def __anext__(self):
+            # Ready on the next turn of the loop
+            fut = loop.create_future()
+            if self.n == 1000:
+                loop.call_soon(fut.set_exception, StopAsyncIteration())
+            else:
+                self.n += 1
+                loop.call_soon(fut.set_result, b'tick\n')
+            return fut
+
+    loop = asyncio.new_event_loop()
+    try:
+        pipe = slug.Pipe()
+        proc = Process(runpy(COUNT), stdin=cls(Ticker(), loop=loop), stdout=pipe.side_in)
+        proc.start()
+        loop.run_until_complete(loop.run_in_executor(None, proc.join))
+        assert pipe.side_out.read().split() == [b'5000', b"b'tick\\nt'"]
+    finally:
+        loop.close()
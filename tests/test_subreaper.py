@@ -0,0 +1,56 @@
+import os
+import signal
+import pytest
+import slug
+from slug import ProcessGroup, Process
+from conftest import runpy
+
+pytestmark = pytest.mark.skipif(not hasattr(slug, 'Subreaper'),
+                                reason="No subreaper on this platform")
+
+# Forks a grandchild that outlives its parent, and reports its PID
+ORPHANER = (
+    "import os, sys, time\n"
+    "pid = os.fork()\n"
+    "if pid == 0:\n"
+    "    if 'setsid' in sys.argv:\n"
+    "        os.setsid()\n"
+    "    time.sleep(30)\n"
+    "else:\n"
+    "    print(pid, flush=True)\n"
+)
+
+
+def test_orphans_adopted():
+    with slug.Subreaper(interval=0.1):
+        pg = ProcessGroup()
+        pipe = slug.Pipe()
+        proc = Process(runpy(ORPHANER), stdout=pipe.side_in)
+        pg.add(proc)
+        pg.start()
+        pipe.side_in.close()
+        orphan = int(pipe.side_out.readline())
+        proc.join()
+
+        pg.join(0.3)
+        assert pg.orphans == {orphan}
+        pg.kill()
+        pg.join(5)
+        assert not pg.orphans
+
+
+def test_unrelated_left_alone():
+    with slug.Subreaper(interval=0.1) as reaper:
+        pg = ProcessGroup()
+        pipe = slug.Pipe()
+        # The grandchild leaves the process group and session
+        proc = Process(runpy(ORPHANER) + ['setsid'], stdout=pipe.side_in)
+        pg.add(proc)
+        pg.start()
+        pipe.side_in.close()
+        orphan = int(pipe.side_out.readline())
+        proc.join()
+        reaper.scan()
+        assert not pg.orphans
+    os.kill(orphan, signal.SIGKILL)
+    os.waitpid(orphan, 0)
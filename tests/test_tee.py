@@ -1,5 +1,8 @@
 import io
-from slug import Tee, Pipe
+import threading
+import time
+import pytest
+from slug import Tee, Pipe, DelimitedFramer, LengthPrefixFramer, TextDecoder
 
 
 def test_tee_basics():
@@ -27,3 +30,127 @@ def test_tee_basics():
     # This is only guarenteed _after_ it appears on the pipe
     assert buf.getvalue() == b'foobar'
     assert closed
+
+
+def test_tee_buffered():
+    pin = Pipe()
+    pout = Pipe()
+    chunks = []
+    t = Tee(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        callback=chunks.append,
+        highwater=64 * 1024,
+    )
+    # Far more than the output pipe holds, but nothing is reading it yet. An
+    # unbuffered Tee would stall and leave this write blocked.
+    data = b'x' * (100 * 1024)
+    pin.side_in.write(data)
+    pin.side_in.close()
+    t.thread.join(5)
+    assert not t.thread.is_alive()
+    assert b''.join(chunks) == data
+    assert t.buffered > 0
+
+    assert pout.side_out.read() == data
+    assert t.buffered == 0
+
+
+def test_tee_buffered_highwater():
+    pin = Pipe()
+    pout = Pipe()
+    chunks = []
+    t = Tee(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        callback=chunks.append,
+        highwater=16 * 1024,
+        lowwater=0,
+    )
+    writer = threading.Thread(target=lambda: (pin.side_in.write(b'x' * (1024 * 1024)),
+                                              pin.side_in.close()), daemon=True)
+    writer.start()
+    time.sleep(0.5)
+    # Stopped reading at the high water mark: the rest stays upstream
+    assert 0 < t.buffered <= 16 * 1024
+    assert sum(map(len, chunks)) < 256 * 1024
+    assert writer.is_alive()
+
+    assert len(pout.side_out.read()) == 1024 * 1024
+    writer.join(5)
+    assert not writer.is_alive()
+
+
+def test_tee_lines():
+    pin = Pipe()
+    pout = Pipe()
+    records = []
+
+    Tee(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        callback=records.append,
+        framing=DelimitedFramer(),
+    )
+    pin.side_in.write(b'spam\negg')
+    pin.side_in.flush()
+    time.sleep(0.1)
+    pin.side_in.write(b's\nham')
+    pin.side_in.close()
+
+    assert pout.side_out.read() == b'spam\neggs\nham'
+    assert records == [b'spam\n', b'eggs\n', b'ham']
+
+
+def test_framers():
+    nul = DelimitedFramer(b'\0', keepends=False, max_record=3)
+    assert nul.feed(b'a\0bcdef') == [b'a', b'bcd']
+    assert nul.feed(b'\0') == [b'ef']
+    assert nul.end() is None
+
+    crlf = DelimitedFramer(b'\r\n')
+    assert crlf.feed(b'spam\r') == []
+    assert crlf.feed(b'\neggs') == [b'spam\r\n']
+    assert crlf.end() == b'eggs'
+
+    lp = LengthPrefixFramer(2, max_record=10)
+    assert lp.feed(b'\0\4sp') == []
+    assert lp.feed(b'am\0\0\0\3egg\0') == [b'spam', b'', b'egg']
+    with pytest.raises(ValueError):
+        lp.end()
+    with pytest.raises(ValueError):
+        lp.feed(b'\xff')
+
+
+def test_tee_decoding():
+    pin = Pipe()
+    pout = Pipe()
+    text = []
+    lines = []
+
+    t = Tee(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        callback=text.append,
+        encoding='utf-8',
+    )
+    assert isinstance(t.decoder, TextDecoder)
+    t.decoder.consumers.append(lines.append)
+    data = 'späm\r\neggs☃\r'.encode('utf-8')
+    for i in range(len(data)):
+        pin.side_in.write(data[i:i + 1])
+        pin.side_in.flush()
+        time.sleep(0.01)
+    pin.side_in.close()
+
+    assert pout.side_out.read() == data
+    assert ''.join(text) == 'späm\neggs☃\n'
+    assert lines == text
+
+
+def test_decoder_errors():
+    out = []
+    decoder = TextDecoder(out.append, encoding='utf-8', errors='replace', newline='')
+    assert decoder(b'a\r\n\xe2\x98') == 'a\r\n'
+    assert decoder.finish() == '�'
+    assert out == ['a\r\n', '�']
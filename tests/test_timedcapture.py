@@ -0,0 +1,57 @@
+import pytest
+import slug
+from slug import Process, Pipe, TimedCapture
+from conftest import runpy
+
+INTERLEAVED = (
+    "import os, time\n"
+    "for i in range(5):\n"
+    "    os.write(1, 'out {}\\n'.format(i).encode())\n"
+    "    time.sleep(0.02)\n"
+    "    os.write(2, 'err {}\\n'.format(i).encode())\n"
+    "    time.sleep(0.02)\n"
+)
+
+
+@pytest.mark.parametrize('cls', [TimedCapture, slug.base.TimedCapture])
+def test_process(cls):
+    proc = Process(runpy(INTERLEAVED))
+    capture = cls.of(proc, lines=True)
+    proc.start()
+    for side_in in capture.side_ins:
+        side_in.close()
+    proc.join()
+    capture.thread.join()
+    assert capture.eof
+    assert [(entry.stream, entry.data) for entry in capture] == [
+        (i % 2, '{} {}\n'.format(('out', 'err')[i % 2], i // 2).encode()) for i in range(10)
+    ]
+    assert list(capture.times) == sorted(capture.times)
+    assert capture.times[-1] - capture.times[0] >= 0.1
+    assert capture.stream(1) == ''.join('err {}\n'.format(i) for i in range(5)).encode()
+
+
+@pytest.mark.parametrize('cls', [TimedCapture, slug.base.TimedCapture])
+def test_lines_across_reads(cls):
+    pipe = Pipe()
+    capture = cls(pipe.side_out, lines=True)
+    pipe.side_in.write(b'spam')
+    pipe.side_in.flush()
+    pipe.side_in.write(b' eggs\nham\nno end')
+    pipe.side_in.close()
+    capture.thread.join()
+    assert [entry.data for entry in capture] == [b'spam eggs\n', b'ham\n', b'no end']
+    assert bytes(capture.data) == b'spam eggs\nham\nno end'
+    assert list(capture.offsets) == [0, 10, 14]
+    assert list(capture.lengths) == [10, 4, 6]
+
+
+@pytest.mark.parametrize('cls', [TimedCapture, slug.base.TimedCapture])
+def test_long_line(cls):
+    pipe = Pipe()
+    capture = cls(pipe.side_out, lines=True)
+    pipe.side_in.write(b'x' * (cls.LINE_MAX * 2 + 10))
+    pipe.side_in.close()
+    capture.thread.join()
+    assert max(capture.lengths) <= cls.LINE_MAX
+    assert len(capture.data) == cls.LINE_MAX * 2 + 10
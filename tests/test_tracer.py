@@ -0,0 +1,47 @@
+import io
+import json
+import threading
+import slug
+from slug import Process, Pipe, Tee, Tracer
+from conftest import runpy
+
+
+def test_trace_pipeline():
+    pout = Pipe()
+    buf = io.BytesIO()
+    done = threading.Event()
+
+    with Tracer() as tracer:
+        proc = Process(runpy('print("spam")'), stdout=pout.side_in)
+        proc.start()
+        pout.side_in.close()
+        Tee(pout.side_out, buf, lambda chunk: None, done.set, keepopen=True)
+        proc.join()
+        done.wait()
+
+    out = io.StringIO()
+    tracer.dump(out)
+    trace = json.loads(out.getvalue())['traceEvents']
+
+    names = {ev['args']['name']: (ev['pid'], ev['tid'])
+             for ev in trace if ev['name'] == 'thread_name'}
+    proc_track = (1, proc.pid)
+    assert proc_track in names.values()
+    assert names['Tee 1'] == (2, 1)
+
+    spans = {(ev['pid'], ev['tid'], ev['name']) for ev in trace if ev['ph'] in 'Xi'}
+    assert proc_track + ('running',) in spans
+    assert proc_track + ('exit',) in spans
+    assert (2, 1, 'read') in spans
+    assert (2, 1, 'write') in spans
+    exit_ev = next(ev for ev in trace if ev['name'] == 'exit')
+    assert exit_ev['args']['return_code'] == 0
+
+
+def test_not_tracing():
+    tracer = Tracer()
+    with tracer:
+        pass
+    Process(runpy('pass')).start()
+    assert slug.base._tracer is None
+    assert tracer.to_json()['traceEvents'][2:] == []
@@ -1,7 +1,5 @@
-import pytest
 import threading
 import time
-import slug
 from slug import Valve, Pipe
 
 
@@ -53,9 +51,6 @@ def test_valve_stop():
     assert timediff > 0.9
 
 
-# Broken on windows, see https://github.com/xonsh/slug/issues/7
-@pytest.mark.skipif(slug.Valve is slug.base.Valve,
-                    reason="Base Valve is broken this way")
 def test_valve_stop_midway():
     pin = Pipe()
     pout = Pipe()
@@ -74,3 +69,44 @@ def test_valve_stop_midway():
     buf = pout.side_out.read(4000)
 
     assert buf == b'spam'
+
+
+def test_valve_rate():
+    pin = Pipe()
+    pout = Pipe()
+    v = Valve(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        rate=40000,
+        burst=4000,
+    )
+    v.turn_on()
+
+    data = b'x' * 44000
+    pin.side_in.write(data)
+    pin.side_in.close()
+
+    s = time.perf_counter()
+    buf = pout.side_out.read()
+    e = time.perf_counter()
+
+    assert buf == data
+    # The burst goes straight through, the other 40000 bytes take a second
+    assert 0.9 < e - s < 2.0
+
+
+def test_valve_rate_bytes():
+    pin = Pipe()
+    pout = Pipe()
+    v = Valve(
+        side_in=pin.side_out,
+        side_out=pout.side_in,
+        rate=1,
+        burst=5,
+    )
+    v.turn_on()
+
+    pin.side_in.write(b'spameggs')
+    time.sleep(0.5)
+    # Exactly the burst, not a chunk
+    assert pout.side_out.read(4000) == b'spame'
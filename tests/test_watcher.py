@@ -0,0 +1,55 @@
+import re
+import time
+from slug import Watcher, Pipe
+
+
+def test_literals_across_chunks():
+    pin = Pipe()
+    pout = Pipe()
+    matches = []
+    Watcher(pin.side_out, pout.side_in, [b'error:', b'err', b'rror'], matches.append)
+
+    pin.side_in.write(b'an er')
+    pin.side_in.flush()
+    time.sleep(0.1)
+    pin.side_in.write(b'ror: terror')
+    pin.side_in.close()
+
+    assert pout.side_out.read() == b'an error: terror'
+    assert [(m.pattern, m.start, m.end) for m in matches] == [
+        (b'err', 3, 6), (b'error:', 3, 9), (b'rror', 4, 8),
+        (b'err', 11, 14), (b'rror', 12, 16),
+    ]
+
+
+def test_regex():
+    pin = Pipe()
+    pout = Pipe()
+    matches = []
+    progress = re.compile(rb'(\d+)%\n')
+    Watcher(pin.side_out, pout.side_in, [progress], matches.append, max_span=16)
+
+    for piece in [b'10%\n2', b'0%\nfoo\n', b'100', b'%\n']:
+        pin.side_in.write(piece)
+        pin.side_in.flush()
+        time.sleep(0.05)
+    pin.side_in.close()
+
+    pout.side_out.read()
+    assert [m.data for m in matches] == [b'10%\n', b'20%\n', b'100%\n']
+    assert all(m.pattern is progress for m in matches)
+    assert matches[-1].start == 12
+
+
+def test_many_literals():
+    pin = Pipe()
+    pout = Pipe()
+    matches = []
+    words = ['w{:03};'.format(i).encode() for i in range(500)]
+    Watcher(pin.side_out, pout.side_in, words, matches.append)
+
+    pin.side_in.write(b'xx'.join(reversed(words)))
+    pin.side_in.close()
+
+    pout.side_out.read()
+    assert [m.data for m in matches] == list(reversed(words))